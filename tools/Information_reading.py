@@ -5,9 +5,20 @@ import sys
 from astropy.io import fits
 import os
 import csv
+from concurrent.futures import ThreadPoolExecutor
+from grid_index import read_manifest
 
 FITS_DIR = r"path/to/fits/dir"
 OUTPUT_DIR = r"path/to/output/dir"
+# 可选：move.py 生成的清单文件，设置后处理清单中列出的文件，而不扫描 FITS_DIR
+MANIFEST_FILE = None
+
+# 目录清单模式：只读取文件头，汇总为一张表；清单文件同时作为缓存，按文件修改时间和大小判断是否需要重新读取
+INVENTORY_FILENAME = "fits_inventory.csv"
+INVENTORY_WORKERS = 16  # 读取文件头的线程数
+KEY_HEADER_CARDS = ['OBJECT', 'TELESCOP', 'INSTRUME', 'DATE-OBS', 'RA', 'DEC',
+                    'PHXTEFF', 'PHXLOGG', 'PHXM_H', 'PHXALPHA']
+INVENTORY_FIELDS = ['file', 'size', 'mtime_ns', 'n_hdus', 'hdus', 'shapes', 'columns'] + KEY_HEADER_CARDS + ['error']
 
 def analyze_fits_file(file_path, output_format='markdown', start_row=0, end_row=2):
 
@@ -116,14 +127,85 @@ def analyze_fits_file(file_path, output_format='markdown', start_row=0, end_row=
         print("详细错误追踪:")
         traceback.print_exc(file=sys.stdout) 
 
+def read_header_summary(file_path):
+    """只读取各 HDU 的文件头（不读取数据段），返回清单中的一行（file 列为绝对路径）"""
+    row = {'file': os.path.abspath(file_path)}
+    try:
+        st = os.stat(file_path)
+    except OSError as e:
+        row['error'] = str(e)
+        return row
+    row['size'], row['mtime_ns'] = st.st_size, st.st_mtime_ns
+    hdus, shapes, columns = [], [], []
+    try:
+        with fits.open(file_path, mode='readonly', lazy_load_hdus=True, ignore_missing_end=True) as hdul:
+            for i, hdu in enumerate(hdul):
+                header = hdu.header
+                hdus.append(f"{i}:{hdu.name}:{type(hdu).__name__}")
+                if isinstance(hdu, (fits.BinTableHDU, fits.TableHDU)):
+                    shapes.append(f"{header.get('NAXIS2', 0)} rows")
+                    columns.append(f"{i}:" + ",".join(f"{col.name}({col.format})" for col in hdu.columns))
+                else:
+                    naxis = header.get('NAXIS', 0)
+                    shapes.append("x".join(str(header.get(f'NAXIS{n}', 0)) for n in range(naxis, 0, -1)) or "-")
+                for key in KEY_HEADER_CARDS:
+                    if key not in row and key in header:
+                        row[key] = header[key]
+    except Exception as e:
+        row['error'] = str(e)
+    row['n_hdus'] = len(hdus)
+    row['hdus'] = "; ".join(hdus)
+    row['shapes'] = "; ".join(shapes)
+    row['columns'] = "; ".join(columns)
+    return row
+
+def load_inventory_cache(inventory_path):
+    """读取已有的清单文件，返回 {绝对路径: 行}"""
+    if not os.path.exists(inventory_path):
+        return {}
+    with open(inventory_path, newline='', encoding='utf-8') as f:
+        return {row['file']: row for row in csv.DictReader(f)}
+
+def build_inventory(fits_files, inventory_path, workers=INVENTORY_WORKERS):
+    """
+    并行读取所有文件的文件头，生成目录清单并写入 inventory_path。
+    大小和修改时间与清单中记录一致的文件直接沿用缓存，不重新打开。
+    """
+    cache = load_inventory_cache(inventory_path)
+
+    def inventory_row(file_path):
+        cached = cache.get(os.path.abspath(file_path))
+        try:
+            st = os.stat(file_path)
+        except OSError as e:  # 运行期间被删除或无法访问
+            return {'file': os.path.abspath(file_path), 'error': str(e)}, False
+        if cached and cached['size'] == str(st.st_size) and cached['mtime_ns'] == str(st.st_mtime_ns):
+            return cached, True
+        return read_header_summary(file_path), False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(inventory_row, fits_files))
+
+    rows = sorted((row for row, _ in results), key=lambda row: row['file'])
+    with open(inventory_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=INVENTORY_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+    reused = sum(1 for _, hit in results if hit)
+    errors = sum(1 for row in rows if row.get('error'))
+    print(f"目录清单已写入: {inventory_path}")
+    print(f"共 {len(rows)} 个文件：沿用缓存 {reused} 个，重新读取文件头 {len(rows) - reused} 个，出错 {errors} 个。")
+
 def get_user_choice():
     """获取用户输出格式选择"""
     print("\n请选择输出格式:")
     print("1. Markdown格式 (默认)")
     print("2. CSV格式")
+    print("3. 目录清单 (仅读取文件头，结果缓存)")
     
     while True:
-        choice = input("请输入选择 (1/2): ").strip()
+        choice = input("请输入选择 (1/2/3): ").strip()
         if not choice or choice == '1':
             return 'markdown', 0, 2
         elif choice == '2':
@@ -132,6 +214,8 @@ def get_user_choice():
                 start_row = int(input("开始行 : ").strip())
                 end_row = int(input("结束行: ").strip())
                 return 'csv', start_row, end_row
+        elif choice == '3':
+            return 'inventory', 0, 0
         else:
             print("无效选择，请重新输入")
 
@@ -142,14 +226,18 @@ if __name__ == "__main__":
 
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    print("查找目录下的 .fits 文件...")
     fits_files = []
     try:
-        for filename in os.listdir(FITS_DIR):
-            if filename.lower().endswith('.fits'):
-                full_path = os.path.join(FITS_DIR, filename)
-                if os.path.isfile(full_path):
-                    fits_files.append(full_path)
+        if MANIFEST_FILE:
+            print(f"读取清单文件: {MANIFEST_FILE}")
+            fits_files = [path for path in read_manifest(MANIFEST_FILE) if path.lower().endswith('.fits')]
+        else:
+            print("查找目录下的 .fits 文件...")
+            for filename in os.listdir(FITS_DIR):
+                if filename.lower().endswith('.fits'):
+                    full_path = os.path.join(FITS_DIR, filename)
+                    if os.path.isfile(full_path):
+                        fits_files.append(full_path)
     except Exception as e:
         print(f"错误: 查找文件时出错 - {e}")
         sys.exit(1)
@@ -165,13 +253,16 @@ if __name__ == "__main__":
         output_format, start_row, end_row = get_user_choice()
 
         fits_files.sort()
-        for file_to_process in fits_files:
-            print("-" * 50)
-            file_path = file_to_process
-            print(f"\n开始处理: {os.path.basename(file_path)}")
-            analyze_fits_file(file_path, output_format, start_row, end_row)
+        if output_format == 'inventory':
+            build_inventory(fits_files, os.path.join(OUTPUT_DIR, INVENTORY_FILENAME))
+        else:
+            for file_to_process in fits_files:
+                print("-" * 50)
+                file_path = file_to_process
+                print(f"\n开始处理: {os.path.basename(file_path)}")
+                analyze_fits_file(file_path, output_format, start_row, end_row)
 
-            print(f"完成处理: {os.path.basename(file_path)}")
+                print(f"完成处理: {os.path.basename(file_path)}")
 
     print("-" * 50)
     print("\n全部文件处理完毕。")
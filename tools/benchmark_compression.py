@@ -0,0 +1,93 @@
+"""
+代码功能：比较插值光谱输出格式（未压缩 PrimaryHDU、无损 GZIP_2、不同 QUANTIZE_LEVEL 的 RICE_1 量化压缩）的
+压缩比、写出与读取吞吐量以及量化误差，用于为 interpolate_spectra.py 选择 OUTPUT_COMPRESSION 设置。
+
+从 SAMPLE_DIR 中取 N_FILES 个光谱，按每种设置写入 BENCH_DIR 下的临时目录，再完整读取一遍并按段读取
+[WINDOW_START, WINDOW_START + WINDOW_LENGTH) 像素。吞吐量按未压缩数据量计算 (MB/s)。
+读取测试受操作系统文件缓存影响，刚写出的文件通常在缓存中，更接近“热”读取的结果。
+"""
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from astropy.io import fits
+from interpolate_spectra import compression_options, spectrum_hdu, write_spectrum
+
+SAMPLE_DIR = r"path/to/Z-0.0"   # 样本光谱目录
+BENCH_DIR = None                # 临时文件所在目录，None 为系统临时目录；应与实际输出位于同一类磁盘
+N_FILES = 20                    # 参与测试的光谱数
+WINDOW_START = 200000           # 按段读取测试的起始像素
+WINDOW_LENGTH = 50000           # 按段读取测试的像素数
+
+# (名称, OUTPUT_COMPRESSION, QUANTIZE_LEVEL)
+SETTINGS = [
+    ("未压缩", None, None),
+    ("无损 GZIP_2", "lossless", None),
+    ("RICE_1 q=64", "quantized", 64),
+    ("RICE_1 q=16", "quantized", 16),
+    ("RICE_1 q=4", "quantized", 4),
+]
+
+
+def load_samples(sample_dir, n_files):
+    files = sorted(f for f in os.listdir(sample_dir) if f.endswith('.fits'))[:n_files]
+    samples = []
+    for filename in files:
+        with fits.open(os.path.join(sample_dir, filename)) as hdul:
+            hdu = spectrum_hdu(hdul)
+            samples.append((filename, np.array(hdu.data), hdu.header.copy()))
+    return samples
+
+
+def benchmark_setting(samples, work_dir, compression):
+    raw_mb = sum(data.nbytes for _, data, _ in samples) / 2**20
+
+    start = time.perf_counter()
+    for filename, data, header in samples:
+        write_spectrum(os.path.join(work_dir, filename), data, header, compression)
+    write_time = time.perf_counter() - start
+    disk_mb = sum(os.path.getsize(os.path.join(work_dir, f)) for f, _, _ in samples) / 2**20
+
+    max_rel_err = 0.0
+    start = time.perf_counter()
+    for filename, data, _ in samples:
+        with fits.open(os.path.join(work_dir, filename)) as hdul:
+            read = np.array(spectrum_hdu(hdul).data)
+        scale = np.abs(data).max() or 1.0
+        max_rel_err = max(max_rel_err, float(np.abs(read.astype(float) - data).max() / scale))
+    read_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for filename, _, _ in samples:
+        with fits.open(os.path.join(work_dir, filename)) as hdul:
+            np.array(spectrum_hdu(hdul).section[WINDOW_START:WINDOW_START + WINDOW_LENGTH])
+    window_time = time.perf_counter() - start
+
+    return {'ratio': raw_mb / disk_mb, 'disk_mb': disk_mb,
+            'write_mbs': raw_mb / write_time, 'read_mbs': raw_mb / read_time,
+            'window_ms': 1000 * window_time / len(samples), 'max_rel_err': max_rel_err}
+
+
+def main():
+    samples = load_samples(SAMPLE_DIR, N_FILES)
+    if not samples:
+        print(f"错误: {SAMPLE_DIR} 中没有 FITS 文件")
+        return
+    raw_mb = sum(data.nbytes for _, data, _ in samples) / 2**20
+    print(f"样本: {len(samples)} 个光谱，每个 {samples[0][1].size} 像素，共 {raw_mb:.1f} MB\n")
+
+    print(f"{'设置':<14}{'压缩比':>8}{'磁盘(MB)':>10}{'写出(MB/s)':>12}{'读取(MB/s)':>12}{'段读取(ms)':>12}{'最大相对误差':>14}")
+    for name, compression, quantize_level in SETTINGS:
+        work_dir = tempfile.mkdtemp(prefix="fits_bench_", dir=BENCH_DIR)
+        try:
+            options = compression_options(compression, quantize_level or 0)
+            r = benchmark_setting(samples, work_dir, options)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        print(f"{name:<14}{r['ratio']:>8.2f}{r['disk_mb']:>10.1f}{r['write_mbs']:>12.1f}"
+              f"{r['read_mbs']:>12.1f}{r['window_ms']:>12.2f}{r['max_rel_err']:>14.2e}")
+
+
+if __name__ == "__main__":
+    main()
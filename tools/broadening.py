@@ -0,0 +1,192 @@
+"""
+代码功能：对光谱做仪器展宽（分辨率 R 的高斯轮廓）和自转展宽（v·sin i，线性临边昏暗），
+在 log-lambda 等速度间隔网格上以 FFT 卷积实现，可一次处理二维批量光谱 (N_spectra, N_points)。
+
+输入网格已是等 Δlnλ 时直接卷积；否则先线性插值到 Δlnλ 不大于原网格最小 Δlnλ 的 log 网格
+（不降低任何波段的采样），卷积后再插值回原网格。
+卷积核及其 FFT 按 (R, vsini, 临边昏暗系数, Δlnλ, FFT 长度) 缓存，重复调用不会重新构建。
+
+直接运行本脚本时，对 INPUT_DIR 中的 PHOENIX 光谱（波长取自 WAVELENGTH_FILE）逐批展宽，
+结果写入 OUTPUT_DIR，文件名不变。
+"""
+import os
+from functools import lru_cache
+import numpy as np
+from astropy.io import fits
+from tqdm import tqdm
+
+WAVELENGTH_FILE = r"path/to/WAVE_PHOENIX-ACES-AGSS-COND-2011.fits"  # 例如 r"D:\PHOENIX-ACES-AGSS-COND-2011\WAVE_PHOENIX-ACES-AGSS-COND-2011.fits"
+INPUT_DIR = r"path/to/Z-0.0"              # 例如 r"D:\PHOENIX-ACES-AGSS-COND-2011\Z-0.0"
+OUTPUT_DIR = r"path/to/Z-0.0_broadened"   # 展宽结果输出目录
+INSTRUMENT_R = 5000       # 仪器分辨率 R = λ/Δλ(FWHM)，None 表示不做仪器展宽
+VSINI = None              # 投影自转速度 (km/s)，None 表示不做自转展宽
+LIMB_DARKENING = 0.6      # 自转展宽的线性临边昏暗系数 ε
+BATCH_SIZE = 16           # 每批同时展宽的光谱数
+KERNEL_CACHE_SIZE = 32    # 缓存的卷积核个数
+
+C_KMS = 299792.458        # 光速 (km/s)
+
+
+def is_log_uniform(wavelength, rtol=1e-6):
+    """判断波长网格是否为等 Δlnλ 网格"""
+    dlnlam = np.diff(np.log(wavelength))
+    return np.allclose(dlnlam, dlnlam[0], rtol=rtol, atol=0)
+
+
+def log_wavelength_grid(wave_min, wave_max, resolution, samples_per_resel):
+    """Δlnλ = 1/(resolution·samples_per_resel) 的等分辨率波长网格，两端点为 wave_min 与 wave_max"""
+    n_points = int(np.ceil(np.log(wave_max / wave_min) * resolution * samples_per_resel)) + 1
+    return np.geomspace(wave_min, wave_max, n_points)
+
+
+def interp_last_axis(x_new, x, values):
+    """沿最后一维做线性插值（x 升序），可一次处理任意前导维度的批量数据"""
+    idx = np.clip(np.searchsorted(x, x_new, side='right') - 1, 0, len(x) - 2)
+    weight = (x_new - x[idx]) / (x[idx + 1] - x[idx])
+    return values[..., idx] * (1 - weight) + values[..., idx + 1] * weight
+
+
+def _fft_length(n):
+    """不小于 n 的最小 2^a·3^b·5^c，FFT 在此长度上最快"""
+    best = 1 << (n - 1).bit_length()
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < n:
+                p *= 2
+            best = min(best, p)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def velocity_kernel(resolution, vsini, epsilon, dlnlam):
+    """在速度间隔 c·Δlnλ 的像素上构建归一化卷积核（长度为奇数，中心为零速度）"""
+    dv = C_KMS * dlnlam
+    kernel = np.ones(1)
+    if resolution:
+        sigma = C_KMS / resolution / (2 * np.sqrt(2 * np.log(2)))
+        half = int(np.ceil(5 * sigma / dv))
+        v = np.arange(-half, half + 1) * dv
+        kernel = np.convolve(kernel, np.exp(-0.5 * (v / sigma)**2))
+    if vsini:
+        half = int(np.ceil(vsini / dv))
+        v = np.arange(-half, half + 1) * dv
+        x = np.clip(1 - (v / vsini)**2, 0, None)
+        kernel = np.convolve(kernel, 2 * (1 - epsilon) * np.sqrt(x) + 0.5 * np.pi * epsilon * x)
+    kernel /= kernel.sum()
+    kernel.flags.writeable = False
+    return kernel
+
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _kernel_fft(resolution, vsini, epsilon, dlnlam, n_fft):
+    kernel = velocity_kernel(resolution, vsini, epsilon, dlnlam)
+    half = len(kernel) // 2
+    wrapped = np.zeros(n_fft)
+    wrapped[:half + 1] = kernel[half:]
+    if half:
+        wrapped[-half:] = kernel[:half]
+    kernel_fft = np.fft.rfft(wrapped)
+    kernel_fft.flags.writeable = False
+    return kernel_fft
+
+
+def _work_grid(wavelength):
+    """卷积所用的等 Δlnλ 网格及其 Δlnλ（缓存键）；输入已是等 Δlnλ 网格时原样返回输入网格"""
+    if is_log_uniform(wavelength):
+        work_wave = wavelength
+    else:
+        # 以原网格最细的 Δlnλ 为步长，避免线性网格红端在等点数 log 网格上欠采样
+        min_dlnlam = np.min(np.diff(np.log(wavelength)))
+        n_work = int(np.ceil(np.log(wavelength[-1] / wavelength[0]) / min_dlnlam)) + 1
+        work_wave = np.geomspace(wavelength[0], wavelength[-1], n_work)
+    # Δlnλ 取有效数字后作为缓存键，避免浮点末位差异导致重复构建
+    dlnlam = float(f"{np.log(work_wave[-1] / work_wave[0]) / (len(work_wave) - 1):.10g}")
+    return work_wave, dlnlam
+
+
+def broaden_peak_bytes(wavelength, n_spectra, resolution=None, vsini=None, epsilon=LIMB_DARKENING):
+    """
+    估算 broaden 一次处理 n_spectra 条光谱的峰值工作内存（字节，偏保守）：float64 输入副本、
+    log 网格上的重采样流量、补边数组、rfft 复数数组与 irfft 结果、插值回原网格的结果
+    （线性插值按 2 个同尺寸临时数组计）。
+    """
+    wavelength = np.asarray(wavelength, dtype=float)
+    n_src = len(wavelength)
+    if not resolution and not vsini:
+        return 8 * n_spectra * n_src
+    work_wave, dlnlam = _work_grid(wavelength)
+    half = len(velocity_kernel(resolution or 0, vsini or 0, epsilon, dlnlam)) // 2
+    n_fft = _fft_length(len(work_wave) + 2 * half)
+
+    per_spectrum = 8 * n_src + 2 * 8 * n_fft + 16 * (n_fft // 2 + 1)
+    if work_wave is not wavelength:
+        per_spectrum += 3 * 8 * len(work_wave) + 3 * 8 * n_src
+    return n_spectra * per_spectrum
+
+
+def broaden(wavelength, flux, resolution=None, vsini=None, epsilon=LIMB_DARKENING):
+    """
+    对 flux（形状 (N_points,) 或 (N_spectra, N_points)）做仪器与自转展宽，返回原波长网格上的展宽流量。
+    resolution 与 vsini 均为 None/0 时原样返回。两端按端点值延拓，避免 FFT 循环卷积的回绕。
+    """
+    wavelength = np.asarray(wavelength, dtype=float)
+    flux = np.asarray(flux, dtype=float)
+    if not resolution and not vsini:
+        return flux
+
+    work_wave, dlnlam = _work_grid(wavelength)
+    log_grid = work_wave is wavelength
+    work_flux = flux if log_grid else interp_last_axis(work_wave, wavelength, flux)
+
+    resolution, vsini = resolution or 0, vsini or 0
+    half = len(velocity_kernel(resolution, vsini, epsilon, dlnlam)) // 2
+    n_points = work_flux.shape[-1]
+    n_fft = _fft_length(n_points + 2 * half)
+
+    padded = np.pad(work_flux, [(0, 0)] * (work_flux.ndim - 1) + [(half, half)], mode='edge')
+    spectrum_fft = np.fft.rfft(padded, n_fft, axis=-1)
+    spectrum_fft *= _kernel_fft(resolution, vsini, epsilon, dlnlam, n_fft)
+    result = np.fft.irfft(spectrum_fft, n_fft, axis=-1)[..., half:half + n_points]
+
+    if not log_grid:
+        result = interp_last_axis(wavelength, work_wave, result)
+    return result
+
+
+def broaden_phoenix_dir(input_dir, output_dir, wavelength_file, resolution=INSTRUMENT_R, vsini=VSINI,
+                        epsilon=LIMB_DARKENING, batch_size=BATCH_SIZE):
+    """逐批展宽目录中的PHOENIX光谱，输出保留原头信息和数据类型，并记录展宽参数"""
+    wavelength = fits.getdata(wavelength_file).astype(float)
+    files = sorted(f for f in os.listdir(input_dir) if f.endswith('.fits'))
+    os.makedirs(output_dir, exist_ok=True)
+
+    for start in tqdm(range(0, len(files), batch_size), desc="展宽进度", unit="批"):
+        batch = files[start:start + batch_size]
+        fluxes = []
+        headers = []
+        dtypes = []
+        for filename in batch:
+            with fits.open(os.path.join(input_dir, filename), memmap=True) as hdul:
+                fluxes.append(np.asarray(hdul[0].data, dtype=float))
+                headers.append(hdul[0].header.copy())
+                dtypes.append(hdul[0].data.dtype)
+
+        broadened = broaden(wavelength, np.array(fluxes), resolution, vsini, epsilon)
+
+        for filename, header, dtype, flux in zip(batch, headers, dtypes, broadened):
+            header['INSTR_R'] = (resolution or 0, 'Instrumental resolving power (0 = none)')
+            header['VSINI'] = (vsini or 0, 'Rotational broadening v sin i (km/s)')
+            header['LIMBDARK'] = (epsilon, 'Linear limb darkening coefficient')
+            header.add_history(f"Broadened: R={resolution or 0}, vsini={vsini or 0} km/s, eps={epsilon}")
+            fits.writeto(os.path.join(output_dir, filename), flux.astype(dtype), header, overwrite=True)
+
+    print(f"完成: 已展宽 {len(files)} 个文件，输出目录 {output_dir}")
+
+
+if __name__ == "__main__":
+    broaden_phoenix_dir(INPUT_DIR, OUTPUT_DIR, WAVELENGTH_FILE)
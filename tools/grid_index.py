@@ -0,0 +1,186 @@
+"""
+代码功能：为PHOENIX网格目录建立持久化的参数索引（SQLite文件），记录每个光谱文件的
+(Teff, logg, [M/H], alpha, 路径, 大小, 修改时间)，供 move.py 与 interpolate_spectra.py
+按参数范围查询，避免每次运行都重新列目录、解析文件名。
+
+索引按目录修改时间增量刷新：目录的 mtime 未变化时不再扫描；发生变化的目录只对新增的
+文件调用 stat，并报告新增、删除（以及可选的修改）条目。
+注意：原地改写文件内容不会改变目录 mtime，如需检测此类修改请使用 check_files=True。
+"""
+import os
+import re
+import sqlite3
+
+INDEX_FILE = "phoenix_grid_index.sqlite"  # 默认索引文件路径
+
+FILENAME_PATTERN = re.compile(
+    r"lte(?P<temp>\d{5})"
+    r"[+-](?P<logg>\d+\.\d+)"
+    r"(?P<metal>[+-]\d+\.\d+)"
+    r"(?:\.Alpha=(?P<alpha>[+-]\d+\.\d+))?"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    directory TEXT PRIMARY KEY,
+    mtime_ns  INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path      TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    filename  TEXT NOT NULL,
+    temp      INTEGER NOT NULL,
+    logg      REAL NOT NULL,
+    metal     REAL NOT NULL,
+    alpha     REAL NOT NULL,
+    size      INTEGER NOT NULL,
+    mtime_ns  INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (directory);
+CREATE INDEX IF NOT EXISTS files_params ON files (temp, logg, metal, alpha);
+"""
+
+
+def parse_params(filename):
+    """解析PHOENIX文件名，返回 (temp, logg, metal, alpha)，无法解析时返回 None"""
+    if not filename.endswith('.fits'):
+        return None
+    match = FILENAME_PATTERN.search(filename)
+    if not match:
+        return None
+    alpha = match.group('alpha')
+    return (int(match.group('temp')),
+            float(match.group('logg')),
+            float(match.group('metal')),
+            float(alpha) if alpha else 0.0)
+
+
+class GridIndex:
+    """PHOENIX网格文件的持久化参数索引"""
+
+    def __init__(self, index_path=INDEX_FILE):
+        self.index_path = index_path
+        self.conn = sqlite3.connect(index_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def refresh(self, directories, check_files=False):
+        """
+        增量刷新索引，返回变化条目 {'added': [...], 'modified': [...], 'removed': [...]}（文件路径列表）。
+        仅 mtime 发生变化的目录会被重新扫描；check_files=True 时强制扫描所有目录并
+        对已有文件重新 stat，以发现原地修改的文件。
+        """
+        changes = {'added': [], 'modified': [], 'removed': []}
+        with self.conn:
+            for directory in directories:
+                directory = os.path.abspath(directory)
+                try:
+                    dir_mtime = os.stat(directory).st_mtime_ns
+                except FileNotFoundError:
+                    self._drop_directory(directory, changes)
+                    continue
+
+                row = self.conn.execute("SELECT mtime_ns FROM dirs WHERE directory = ?",
+                                        (directory,)).fetchone()
+                if row is not None and row['mtime_ns'] == dir_mtime and not check_files:
+                    continue
+
+                self._scan_directory(directory, check_files, changes)
+                self.conn.execute("INSERT OR REPLACE INTO dirs (directory, mtime_ns) VALUES (?, ?)",
+                                  (directory, dir_mtime))
+        return changes
+
+    def _drop_directory(self, directory, changes):
+        removed = [r['path'] for r in self.conn.execute(
+            "SELECT path FROM files WHERE directory = ?", (directory,))]
+        self.conn.execute("DELETE FROM files WHERE directory = ?", (directory,))
+        self.conn.execute("DELETE FROM dirs WHERE directory = ?", (directory,))
+        changes['removed'].extend(removed)
+
+    def _scan_directory(self, directory, check_files, changes):
+        known = {r['filename']: (r['size'], r['mtime_ns']) for r in self.conn.execute(
+            "SELECT filename, size, mtime_ns FROM files WHERE directory = ?", (directory,))}
+
+        seen = set()
+        upserts = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                params = parse_params(entry.name)
+                if params is None or not entry.is_file():
+                    continue
+                seen.add(entry.name)
+                if entry.name in known and not check_files:
+                    continue
+
+                st = entry.stat()
+                if entry.name in known:
+                    if known[entry.name] == (st.st_size, st.st_mtime_ns):
+                        continue
+                    changes['modified'].append(entry.path)
+                else:
+                    changes['added'].append(entry.path)
+                upserts.append((entry.path, directory, entry.name, *params, st.st_size, st.st_mtime_ns))
+
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO files (path, directory, filename, temp, logg, metal, alpha, size, mtime_ns) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", upserts)
+
+        gone = [name for name in known if name not in seen]
+        if gone:
+            gone_paths = [os.path.join(directory, name) for name in gone]
+            self.conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in gone_paths])
+            changes['removed'].extend(gone_paths)
+
+    def query(self, temp_range=None, logg_range=None, metal_range=None, alpha_range=None, directory=None):
+        """按参数范围（闭区间）查询文件，返回 sqlite3.Row 列表（可按列名访问）"""
+        clauses = []
+        args = []
+        for column, value_range in (('temp', temp_range), ('logg', logg_range),
+                                    ('metal', metal_range), ('alpha', alpha_range)):
+            if value_range is not None:
+                clauses.append(f"{column} BETWEEN ? AND ?")
+                args.extend(value_range)
+        if directory is not None:
+            clauses.append("directory = ?")
+            args.append(os.path.abspath(directory))
+
+        sql = "SELECT * FROM files"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY path"
+        return self.conn.execute(sql, args).fetchall()
+
+
+def print_changes(changes, limit=20, log=print):
+    """输出索引刷新结果摘要，每类变化最多列出 limit 条"""
+    for kind, label in (('added', '新增'), ('modified', '修改'), ('removed', '删除')):
+        for path in changes[kind][:limit]:
+            log(f"索引{label}: {path}")
+        if len(changes[kind]) > limit:
+            log(f"索引{label}: ... 其余 {len(changes[kind]) - limit} 条未列出")
+    log(f"索引刷新完成: 新增 {len(changes['added'])}，修改 {len(changes['modified'])}，"
+          f"删除 {len(changes['removed'])}")
+
+
+def write_manifest(manifest_path, paths, description=""):
+    """把选中的文件路径（转为绝对路径）逐行写入清单文件，以 # 开头的行为注释"""
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        if description:
+            f.write(f"# {description}\n")
+        for path in paths:
+            f.write(os.path.abspath(path) + "\n")
+
+
+def read_manifest(manifest_path):
+    """读取清单文件，返回其中的文件路径列表（忽略空行和注释行）"""
+    with open(manifest_path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
@@ -1,10 +1,17 @@
 import os
 import re
+import json
+import sqlite3
 import logging
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from pathlib import Path
 import numpy as np
 from astropy.io import fits
 from tqdm import tqdm
+from grid_index import GridIndex, print_changes, read_manifest
+from broadening import broaden, broaden_peak_bytes, interp_last_axis, log_wavelength_grid
 
 """
 请根据实际情况修改以下路径
@@ -18,6 +25,44 @@ OUTPUT_DIR = r"D:\PHOENIX-ACES-AGSS-COND-2011\Z+0.75"
 SOURCE_A_DIR = r"path/to/Z-0.0"
 SOURCE_B_DIR = r"path/to/Z+0.5"
 OUTPUT_DIR = r"path/to/Z+0.25"
+# 可选：参数索引文件（见 grid_index.py），设置后从索引获取文件列表而不再扫描源目录
+INDEX_FILE = None
+# 可选：move.py 生成的清单文件。设置后，源目录中只有清单列出的文件参与插值；
+# 清单中没有任何条目的源目录不受限制（例如只为 A 目录筛选子集时，B 目录照常查找配对文件）
+MANIFEST_FILE = None
+WORKERS = 1               # 并行进程数，1 为串行处理
+MAX_IN_FLIGHT_MB = 4096   # 并行时同时处理中的文件对占用内存上限 (MB)
+# 内存映射读取源文件，并在与源数据相同精度的预分配缓冲区中计算插值结果
+MEMMAP_IO = True
+# 可选：波长窗口。设置 PHOENIX 波长文件与窗口 (最小, 最大) Å 后，只读取、插值并写出窗口内的像素，
+# 输出头中记录窗口对应的波长信息（等间隔或等 Δlnλ 时写入 WCS）
+WAVELENGTH_FILE = None    # 例如 r"D:\PHOENIX-ACES-AGSS-COND-2011\WAVE_PHOENIX-ACES-AGSS-COND-2011.fits"
+WAVE_WINDOW = None        # 例如 (3690, 9100)，LAMOST 低分辨率光谱范围
+# 可选：降分辨率。设置 TARGET_R 后（需要 WAVELENGTH_FILE），插值结果在写出前卷积到分辨率 TARGET_R，
+# 并重采样到每分辨元 TARGET_SAMPLES_PER_RESEL 个点的 log-lambda 网格（范围为 TARGET_WAVE_RANGE，
+# 缺省为波长窗口或全部波长），不再写出全分辨率的中间文件
+TARGET_R = None           # 例如 1800，LAMOST 低分辨率光谱
+TARGET_SAMPLES_PER_RESEL = 2.0
+TARGET_WAVE_RANGE = None
+# 可选：输出压缩。None 为不压缩的 PrimaryHDU；"lossless" 为 GZIP_2 无损压缩；
+# "quantized" 为 RICE_1 量化压缩（有损，量化步长为噪声估计的 1/QUANTIZE_LEVEL，越大越精确）。
+# 压缩输出为 float32 分块 (CompImageHDU，位于第 1 个扩展)，分块长度 COMPRESSION_TILE 个像素，可按段解压读取
+OUTPUT_COMPRESSION = None
+QUANTIZE_LEVEL = 16
+COMPRESSION_TILE = 65536
+# 运行清单（SQLite，相对路径时位于输出目录/输出根目录下），记录每个输出的源文件大小与修改时间、
+# 输出文件状态。重新运行时跳过源文件与输出均未变化的条目，只处理缺失、失败或过期的输出；None 表示总是全部重算
+OUTPUT_MANIFEST = ".interpolation_manifest.sqlite"
+
+# 可选：多目录、多目标金属丰度插值（interpolate_metallicity_grid）。
+# SOURCE_DIRS 非空时运行该模式：每个 (Teff, logg, alpha) 节点的源光谱只读取一次，
+# 对所有被相邻源目录包围的 TARGET_FEHS 做线性插值，结果写入 GRID_OUTPUT_ROOT/Z±x.x
+SOURCE_DIRS = []  # 例如 [r"path/to/Z-2.0", r"path/to/Z-1.5", r"path/to/Z-1.0", r"path/to/Z-0.5", r"path/to/Z-0.0", r"path/to/Z+0.5", r"path/to/Z+1.0"]
+TARGET_FEHS = [round(-2.0 + 0.1 * i, 1) for i in range(31)]  # -2.0 到 +1.0，步长 0.1 dex
+GRID_OUTPUT_ROOT = r"path/to/output"
+
+# PhoenixGridInterpolator（任意 (Teff, logg, [M/H], alpha) 的多线性插值）缓存的内存映射流量总大小上限 (MB)
+GRID_CACHE_MB = 2048
 
 LOG_FILE = "interpolation.log"
 logging.basicConfig(level=logging.INFO,
@@ -34,6 +79,85 @@ FILENAME_PATTERN = re.compile(
 
 METALLICITY_PATH_PATTERN = re.compile(r"^Z([+-]\d+\.\d+)$")
 
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    output       TEXT PRIMARY KEY,
+    inputs       TEXT NOT NULL,
+    recipe       TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    message      TEXT,
+    out_size     INTEGER,
+    out_mtime_ns INTEGER
+);
+"""
+
+class OutputManifest:
+    """
+    插值运行清单：每个输出文件一行，记录源文件 (路径, 大小, 修改时间)、插值参数、状态及输出文件的大小与修改时间。
+    结果按 commit_every 条批量提交，中断时最多重算最后一批。
+    """
+
+    def __init__(self, manifest_path, commit_every=200):
+        self.conn = sqlite3.connect(manifest_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(MANIFEST_SCHEMA)
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self._stat_cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def input_signature(self, paths):
+        """源文件签名（JSON 字符串），同一次运行中每个文件只 stat 一次"""
+        signature = []
+        for path in paths:
+            key = str(path)
+            if key not in self._stat_cache:
+                st = os.stat(path)
+                self._stat_cache[key] = (st.st_size, st.st_mtime_ns)
+            signature.append([key, *self._stat_cache[key]])
+        return json.dumps(signature)
+
+    def is_up_to_date(self, output_path, inputs, recipe):
+        """输出已成功生成、源文件与插值参数未变且输出文件未被改动时返回 True"""
+        row = self.conn.execute("SELECT * FROM outputs WHERE output = ?", (str(output_path),)).fetchone()
+        if row is None or row['status'] != 'done' or row['inputs'] != inputs or row['recipe'] != recipe:
+            return False
+        try:
+            st = os.stat(output_path)
+        except FileNotFoundError:
+            return False
+        return (st.st_size, st.st_mtime_ns) == (row['out_size'], row['out_mtime_ns'])
+
+    def record(self, output_path, inputs, recipe, failure):
+        """记录一个输出的处理结果，failure 为 None（成功）或 (日志级别, 信息)"""
+        if failure is None:
+            st = os.stat(output_path)
+            values = ('done', None, st.st_size, st.st_mtime_ns)
+        else:
+            values = ('error', failure[1], None, None)
+        self.conn.execute("INSERT OR REPLACE INTO outputs (output, inputs, recipe, status, message, out_size, out_mtime_ns) "
+                          "VALUES (?, ?, ?, ?, ?, ?, ?)", (str(output_path), inputs, recipe, *values))
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self.conn.commit()
+            self._uncommitted = 0
+
+def _open_output_manifest(output_manifest, output_dir):
+    if not output_manifest:
+        return None
+    manifest_path = Path(output_dir) / output_manifest
+    logging.info(f"使用运行清单: {manifest_path}")
+    return OutputManifest(manifest_path)
+
 def parse_filename(filename):
     match = FILENAME_PATTERN.match(filename)
     if match:
@@ -88,7 +212,479 @@ def generate_output_filename(params, interp_feh, model_suffix):
     )
     return filename
 
-def interpolate_spectra(source_a_dir, source_b_dir, output_dir):
+def format_metallicity_dir(feh):
+    """目标金属丰度对应的目录名，如 Z-0.5、Z+0.25；太阳丰度与PHOENIX网格一致记为 Z-0.0"""
+    if np.isclose(feh, 0.0):
+        return "Z-0.0"
+    feh_str = f"{feh:+.2f}"
+    if feh_str.endswith('0'):
+        feh_str = feh_str[:-1]
+    return f"Z{feh_str}"
+
+WCS_KEYWORDS = ('CTYPE1', 'CUNIT1', 'CRPIX1', 'CRVAL1', 'CDELT1', 'CD1_1')
+
+def resolve_wavelength_window(wavelength_file, wave_window):
+    """
+    在PHOENIX波长文件中查找波长窗口，返回 (window, fraction)。
+    window 为 (起始像素, 结束像素, 头关键字列表)，传给插值函数；fraction 为窗口像素占全部像素的比例。
+    未设置波长文件或窗口时返回 (None, 1.0)。
+    """
+    if not wavelength_file or not wave_window:
+        return None, 1.0
+    with fits.open(wavelength_file, memmap=True) as hdul:
+        wavelength = hdul[0].data
+        start = int(np.searchsorted(wavelength, wave_window[0], side='left'))
+        stop = int(np.searchsorted(wavelength, wave_window[1], side='right'))
+        window_wave = np.array(wavelength[start:stop], dtype=float)
+        n_total = len(wavelength)
+    if len(window_wave) < 2:
+        raise ValueError(f"波长窗口 {wave_window} 在 {wavelength_file} 中不足两个像素")
+
+    cards = [('WAVEFILE', os.path.basename(wavelength_file), 'Wavelength file of the full grid'),
+             ('WPIXOFF', start, 'Index of first pixel in the wavelength file'),
+             ('WAVEMIN', window_wave[0], 'Minimum wavelength (Angstrom)'),
+             ('WAVEMAX', window_wave[-1], 'Maximum wavelength (Angstrom)')]
+    step = np.diff(window_wave)
+    dlnlam = np.diff(np.log(window_wave))
+    # 窗口内等间隔或等 Δlnλ 时写入 WCS（WAVE-LOG: λ = CRVAL1·exp(CDELT1·(p - CRPIX1)/CRVAL1)）
+    if np.allclose(step, step[0], rtol=1e-6, atol=0):
+        ctype, cdelt = 'WAVE', step[0]
+    elif np.allclose(dlnlam, dlnlam[0], rtol=1e-6, atol=0):
+        ctype, cdelt = 'WAVE-LOG', window_wave[0] * dlnlam[0]
+    else:
+        ctype = None
+    if ctype:
+        cards += [('CTYPE1', ctype, ''), ('CUNIT1', 'Angstrom', ''), ('CRPIX1', 1.0, ''),
+                  ('CRVAL1', window_wave[0], ''), ('CDELT1', cdelt, '')]
+
+    logging.info(f"波长窗口 {wave_window[0]}-{wave_window[1]} Å: 像素 [{start}, {stop})，"
+                 f"占全部 {n_total} 个像素的 {(stop - start) / n_total:.1%}")
+    return (start, stop, cards), (stop - start) / n_total
+
+def resolve_degrade(wavelength_file, window, target_r, target_wave_range=None,
+                    samples_per_resel=TARGET_SAMPLES_PER_RESEL):
+    """
+    准备降分辨率阶段，返回传给插值函数的 degrade 元组
+    (波长文件, 起始像素, 结束像素, 目标分辨率, 目标波长网格, 头关键字列表)；未设置 target_r 时返回 None。
+    """
+    if not target_r:
+        return None
+    if not wavelength_file:
+        raise ValueError("降分辨率需要设置 PHOENIX 波长文件 WAVELENGTH_FILE")
+    with fits.open(wavelength_file, memmap=True) as hdul:
+        n_total = len(hdul[0].data)
+    start, stop = (window[0], window[1]) if window else (0, n_total)
+    source_wave = _load_wavelength(wavelength_file, start, stop)
+
+    wave_min, wave_max = target_wave_range or (source_wave[0], source_wave[-1])
+    wave_min, wave_max = max(wave_min, source_wave[0]), min(wave_max, source_wave[-1])
+    target_wave = log_wavelength_grid(wave_min, wave_max, target_r, samples_per_resel)
+
+    dlnlam = np.log(target_wave[1] / target_wave[0])
+    cards = [('WAVEMIN', target_wave[0], 'Minimum wavelength (Angstrom)'),
+             ('WAVEMAX', target_wave[-1], 'Maximum wavelength (Angstrom)'),
+             ('RESOLVP', target_r, 'Resolving power R after degradation'),
+             ('SAMPRES', samples_per_resel, 'Samples per resolution element'),
+             ('CTYPE1', 'WAVE-LOG', ''), ('CUNIT1', 'Angstrom', ''), ('CRPIX1', 1.0, ''),
+             ('CRVAL1', target_wave[0], ''), ('CDELT1', target_wave[0] * dlnlam, '')]
+    logging.info(f"降分辨率: R={target_r}，{stop - start} 个源像素重采样为 {len(target_wave)} 个点 "
+                 f"({target_wave[0]:.1f}-{target_wave[-1]:.1f} Å)")
+    return wavelength_file, start, stop, target_r, target_wave, cards
+
+@lru_cache(maxsize=4)
+def _load_wavelength(wavelength_file, start, stop):
+    """读取波长文件中 [start, stop) 的波长（每个进程缓存，任务中只传文件名和像素范围）"""
+    with fits.open(wavelength_file, memmap=True) as hdul:
+        return np.array(hdul[0].data[start:stop], dtype=float)
+
+def _degrade(flux, degrade):
+    """把窗口内的源光谱（单条或 (N, 像素数) 批量）卷积到目标分辨率并重采样到目标波长网格"""
+    wavelength_file, start, stop, target_r, target_wave, _ = degrade
+    wavelength = _load_wavelength(wavelength_file, start, stop)
+    return interp_last_axis(target_wave, wavelength, broaden(wavelength, flux, resolution=target_r))
+
+def _degrade_mb(degrade, n_spectra):
+    """降分辨率阶段一次处理 n_spectra 条光谱的峰值工作内存估算 (MB)，未设置 degrade 时为 0"""
+    if degrade is None:
+        return 0
+    wavelength_file, start, stop, target_r, _, _ = degrade
+    return broaden_peak_bytes(_load_wavelength(wavelength_file, start, stop), n_spectra, resolution=target_r) / 2**20
+
+def _source_window(wave_window, target_r, target_wave_range):
+    """未设置波长窗口但降分辨率限定了目标范围时，只读取目标范围两侧各加 5 个分辨元的源像素"""
+    if wave_window or not (target_r and target_wave_range):
+        return wave_window
+    wave_min, wave_max = target_wave_range
+    return wave_min * (1 - 5 / target_r), wave_max * (1 + 5 / target_r)
+
+def _degrade_recipe(degrade):
+    if degrade is None:
+        return "degrade=None"
+    target_wave = degrade[4]
+    return f"degrade=R{degrade[3]} grid={target_wave[0]:.6f}-{target_wave[-1]:.6f}/{len(target_wave)}"
+
+def compression_options(compression=OUTPUT_COMPRESSION, quantize_level=QUANTIZE_LEVEL, tile=COMPRESSION_TILE):
+    """把压缩设置转为 CompImageHDU 参数（dict），不压缩时返回 None"""
+    if compression is None:
+        return None
+    if compression == "lossless":
+        return {'compression_type': 'GZIP_2', 'quantize_level': 0, 'tile': tile}
+    if compression == "quantized":
+        if quantize_level <= 0:
+            raise ValueError("量化压缩需要 QUANTIZE_LEVEL > 0")
+        return {'compression_type': 'RICE_1', 'quantize_level': quantize_level, 'tile': tile}
+    raise ValueError(f"未知的压缩设置: {compression}")
+
+def write_spectrum(output_path, data, header, compression=None):
+    """写出光谱：不压缩时为 PrimaryHDU，压缩时为空主HDU + float32 分块压缩的 CompImageHDU"""
+    if compression is None:
+        fits.PrimaryHDU(data=data, header=header).writeto(output_path, overwrite=True)
+        return
+    data = np.asarray(data, dtype=np.float32)
+    tile_shape = (1,) * (data.ndim - 1) + (min(compression['tile'], data.shape[-1]),)
+    comp_hdu = fits.CompImageHDU(data=data, header=header, compression_type=compression['compression_type'],
+                                 quantize_level=compression['quantize_level'], tile_shape=tile_shape)
+    fits.HDUList([fits.PrimaryHDU(), comp_hdu]).writeto(output_path, overwrite=True)
+
+def spectrum_hdu(hdul):
+    """返回含光谱数据的HDU：未压缩文件为主HDU，压缩文件为第 1 个扩展"""
+    if len(hdul) > 1 and hdul[0].header.get('NAXIS', 0) == 0:
+        return hdul[1]
+    return hdul[0]
+
+def _source_mb(path, window_fraction=1.0):
+    """
+    源光谱（窗口内）解压后的数据量 (MB)，按光谱HDU文件头中的数据形状与元素大小计算；
+    压缩文件的磁盘大小比数据小一个压缩比，不能用于估算内存。
+    """
+    with fits.open(path, memmap=True) as hdul:
+        header = spectrum_hdu(hdul).header
+        n_values = np.prod([header.get(f'NAXIS{i}', 0) for i in range(1, header.get('NAXIS', 0) + 1)])
+        return window_fraction * n_values * (abs(header['BITPIX']) // 8) / 2**20
+
+def _compression_recipe(compression):
+    if compression is None:
+        return "compression=None"
+    return f"compression={compression['compression_type']}/q{compression['quantize_level']}/t{compression['tile']}"
+
+def _read_window(hdu, window):
+    """读取HDU数据；设置窗口时只读取窗口内的像素（按段读取，不加载整个数组）"""
+    if window is None:
+        return hdu.data
+    return hdu.section[window[0]:window[1]]
+
+def _apply_wavelength_header(header, window, degrade):
+    """按降分辨率后的网格（优先）或波长窗口更新输出头中的波长信息"""
+    cards = degrade[-1] if degrade else window[-1] if window else None
+    if cards is None:
+        return
+    for key in WCS_KEYWORDS:
+        header.remove(key, ignore_missing=True)
+    for key, value, comment in cards:
+        header[key] = (value, comment)
+
+def bracket_weights(source_fehs, target_fehs):
+    """
+    计算线性插值权重。source_fehs 需升序排列。
+    返回 (被包围的目标下标, 权重矩阵 (N_目标 × N_源))；与某个源金属丰度相同或超出源范围的目标不包含在内。
+    """
+    source_fehs = np.asarray(source_fehs, dtype=float)
+    target_fehs = np.asarray(target_fehs, dtype=float)
+    upper = np.searchsorted(source_fehs, target_fehs)
+    bracketed = (upper > 0) & (upper < len(source_fehs))
+    bracketed &= ~np.isclose(target_fehs[:, None], source_fehs[None, :]).any(axis=1)
+    target_idx = np.flatnonzero(bracketed)
+    upper = upper[target_idx]
+    lower = upper - 1
+
+    w_upper = (target_fehs[target_idx] - source_fehs[lower]) / (source_fehs[upper] - source_fehs[lower])
+    weights = np.zeros((len(target_idx), len(source_fehs)))
+    rows = np.arange(len(target_idx))
+    weights[rows, lower] = 1.0 - w_upper
+    weights[rows, upper] = w_upper
+    return target_idx, weights
+
+def _interpolate_node(source_paths, source_fehs, target_fehs, weights, output_paths, window=None, degrade=None,
+                      compression=None):
+    """
+    读取同一 (Teff, logg, alpha) 节点在各源目录中的光谱（每个文件只读一次，设置 window 时只读窗口内像素），
+    通过一次权重矩阵 (N_目标 × N_源) 乘法得到所有目标金属丰度的光谱，设置 degrade 时整批降分辨率后写出。
+    返回每个目标的结果列表，元素含义同 _interpolate_pair。
+    """
+    names = [path.name for path in source_paths]
+    try:
+        headers = []
+        stack = None
+        for i, path in enumerate(source_paths):
+            with fits.open(path, memmap=True) as hdul:
+                if len(hdul) == 0:
+                    return [(logging.WARNING, f"文件 {path.name} 没有有效的 HDU，已跳过该节点。")] * len(output_paths)
+                hdu = spectrum_hdu(hdul)
+                data = _read_window(hdu, window)
+                if stack is None:
+                    src_dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.dtype(np.float32)
+                    stack = np.empty((len(source_paths), data.size), dtype=src_dtype.newbyteorder('='))
+                    shape = data.shape
+                elif data.shape != shape:
+                    return [(logging.WARNING, f"文件 {path.name} 与 {names[0]} 的数据形状不匹配，已跳过该节点。")] * len(output_paths)
+                stack[i] = data.ravel()
+                headers.append(hdu.header.copy())
+
+        flux_out = weights.astype(stack.dtype) @ stack
+        if degrade is not None:
+            flux_out = _degrade(flux_out, degrade)
+            shape = flux_out.shape[1:]
+    except Exception as e:
+        return [(logging.ERROR, f"读取节点文件 {', '.join(names)} 时出错: {e}")] * len(output_paths)
+
+    results = []
+    for t, output_path in enumerate(output_paths):
+        lower, upper = np.flatnonzero(weights[t])
+        try:
+            hdr_new = headers[lower].copy()
+            hdr_new['SRCMET_1'] = (source_fehs[lower], 'Metallicity of source spectrum 1')
+            hdr_new['SRCMET_2'] = (source_fehs[upper], 'Metallicity of source spectrum 2')
+            hdr_new['FEH_INT'] = (target_fehs[t], 'Interpolated [Fe/H]')
+            hdr_new['INTWGT_2'] = (weights[t, upper], 'Interpolation weight of source spectrum 2')
+            hdr_new['HISTORY'] = (f"Interpolated from {names[lower]} (Z={source_fehs[lower]}) "
+                                  f"and {names[upper]} (Z={source_fehs[upper]})")
+            hdr_new.add_history(f"Interpolation script: {os.path.basename(__file__)}")
+            _apply_wavelength_header(hdr_new, window, degrade)
+
+            data = flux_out[t].reshape(shape).astype(src_dtype, copy=False)
+            write_spectrum(output_path, data, hdr_new, compression)
+            results.append(None)
+        except Exception as e:
+            results.append((logging.ERROR, f"写出插值光谱 {output_path.name} 时出错: {e}"))
+    return results
+
+def _interpolate_pair(file_a_path, file_b_path, output_path, z1, z2, z3, memmap_io=MEMMAP_IO, window=None,
+                      degrade=None, compression=None):
+    """
+    对一对光谱文件插值并写出结果（设置 window 时只读取并写出窗口内像素，设置 degrade 时降分辨率后写出）。成功时返回 None，失败时返回 (日志级别, 信息)。
+    本函数不直接写日志，以便在子进程中运行时由主进程统一记录。
+    """
+    filename_a = file_a_path.name
+    filename_b = file_b_path.name
+    try:
+        with fits.open(file_a_path, memmap=memmap_io) as hdul_a, fits.open(file_b_path, memmap=memmap_io) as hdul_b:
+            if len(hdul_a) == 0 or len(hdul_b) == 0:
+                return logging.WARNING, f"文件 {filename_a} 或 {filename_b} 没有有效的 HDU，已跳过。"
+            hdu_a = spectrum_hdu(hdul_a)
+            flux_a = _read_window(hdu_a, window)
+            flux_b = _read_window(spectrum_hdu(hdul_b), window)
+            hdr_a = hdu_a.header
+
+            if flux_a.shape != flux_b.shape:
+                return logging.WARNING, f"文件 {filename_a} 和 {filename_b} 的数据形状不匹配，已跳过。"
+
+            if memmap_io and np.issubdtype(flux_a.dtype, np.floating):
+                # 直接在源数据类型（含字节序）的输出缓冲区中原位计算，避免临时数组和 float64 提升，
+                # 写出时也无需再做字节序转换
+                flux_interp = np.empty(flux_a.shape, dtype=flux_a.dtype)
+                np.add(flux_a, flux_b, out=flux_interp, casting='same_kind')
+                flux_interp *= 0.5
+            else:
+                flux_interp = (flux_a + flux_b) / 2.0
+            if degrade is not None:
+                flux_interp = _degrade(flux_interp, degrade).astype(flux_interp.dtype)
+
+            hdr_new = hdr_a.copy()
+            hdr_new['SRCMET_1'] = (z1, 'Metallicity of source spectrum 1')
+            hdr_new['SRCMET_2'] = (z2, 'Metallicity of source spectrum 2')
+            hdr_new['FEH_INT'] = (z3, 'Interpolated [Fe/H]')
+            hdr_new['HISTORY'] = f"Interpolated from {filename_a} (Z={z1}) and {filename_b} (Z={z2})"
+            hdr_new.add_history(f"Interpolation script: {os.path.basename(__file__)}")
+            _apply_wavelength_header(hdr_new, window, degrade)
+
+            write_spectrum(output_path, flux_interp, hdr_new, compression)
+            return None
+
+    except Exception as e:
+        return logging.ERROR, f"处理文件对 {filename_a} 和 {filename_b} 时出错: {e}"
+
+def _run_tasks(worker, tasks, workers, max_in_flight_mb, task_mb):
+    """
+    依次（workers <= 1）或在进程池中执行 worker(*task)，逐个产出 (task, 结果)，并行时按完成顺序产出。
+    进程池模式下按每个任务约 task_mb 的内存估算，同时在处理中的任务数量受 max_in_flight_mb 限制。
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield task, worker(*task)
+        return
+
+    max_in_flight = max(1, min(2 * workers, int(max_in_flight_mb // max(task_mb, 1e-6))))
+    if max_in_flight < workers:
+        logging.warning(f"内存上限 {max_in_flight_mb} MB 仅允许 {max_in_flight} 个任务同时处理，少于进程数 {workers}。")
+
+    with ProcessPoolExecutor(max_workers=min(workers, max_in_flight)) as executor:
+        pending = {}
+        for task in tasks:
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+            pending[executor.submit(worker, *task)] = task
+        for future in as_completed(pending):
+            yield pending[future], future.result()
+
+def _list_source_files(source_dirs, index_file=None, manifest_file=None):
+    """
+    列出各源目录中的光谱文件；设置 index_file 时从参数索引获取而不扫描目录，
+    设置 manifest_file 时只保留清单中列出的文件（清单未涉及的目录不受限制）。
+    """
+    if index_file:
+        with GridIndex(index_file) as index:
+            print_changes(index.refresh(source_dirs), log=logging.info)
+            listings = [[Path(row['path']) for row in index.query(directory=d)] for d in source_dirs]
+    else:
+        listings = [list(Path(d).glob("lte*.fits")) for d in source_dirs]
+
+    if manifest_file:
+        manifest = set(read_manifest(manifest_file))
+        manifest_dirs = {os.path.dirname(path) for path in manifest}
+        for i, d in enumerate(source_dirs):
+            if os.path.abspath(d) in manifest_dirs:
+                listings[i] = [path for path in listings[i] if os.path.abspath(path) in manifest]
+                logging.info(f"按清单 {manifest_file} 筛选 {d}: 保留 {len(listings[i])} 个文件")
+    return listings
+
+class PhoenixGridInterpolator:
+    """
+    PHOENIX网格的四维 (Teff, logg, [M/H], alpha) 多线性插值器。
+    对每个维度找到包围目标值的两个网格值（与网格值相同时只取一个），用 2^k 个角点光谱的加权和得到插值光谱。
+    角点光谱以内存映射方式打开，保存在总大小不超过 cache_mb 的 LRU 缓存中；
+    批量插值时每个角点只读取一次并累加到所有用到它的目标上。
+    logg 取正值（文件名中的 "-4.50" 对应 logg = 4.5）。
+    设置 wavelength_file 时 wavelength 属性为对应的波长（设置 wave_window 时只含窗口内像素，插值也只取窗口内像素）。
+    """
+
+    def __init__(self, source_dirs, index_file=INDEX_FILE, manifest_file=MANIFEST_FILE, cache_mb=GRID_CACHE_MB,
+                 wavelength_file=WAVELENGTH_FILE, wave_window=WAVE_WINDOW):
+        self.window, _ = resolve_wavelength_window(wavelength_file, wave_window)
+        self.wavelength = None
+        if wavelength_file:
+            wavelength = fits.getdata(wavelength_file).astype(float)
+            self.wavelength = wavelength[self.window[0]:self.window[1]] if self.window else wavelength
+        self.nodes = {}
+        for files in _list_source_files([Path(d) for d in source_dirs], index_file, manifest_file):
+            for path in files:
+                params = parse_filename(path.name)
+                if not params:
+                    continue
+                key = (params['Teff'], -params['logg'] + 0.0, params['feh'], params['alpha'])
+                if key in self.nodes:
+                    logging.warning(f"网格节点 {key} 重复，忽略 {path}")
+                    continue
+                self.nodes[key] = path
+        if not self.nodes:
+            raise ValueError("源目录中没有可解析的PHOENIX光谱文件")
+
+        self.axes = [np.unique([key[i] for key in self.nodes]) for i in range(4)]
+        self.cache_bytes = int(cache_mb * 2**20)
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        logging.info(f"网格插值器: {len(self.nodes)} 个节点，各维取值数 "
+                     f"Teff {len(self.axes[0])}, logg {len(self.axes[1])}, [M/H] {len(self.axes[2])}, alpha {len(self.axes[3])}")
+
+    @staticmethod
+    def _bracket(values, x, name):
+        """返回 [(网格值, 权重), ...]，x 与网格值相同时只含一项"""
+        i = np.searchsorted(values, x)
+        for j in (i - 1, i):
+            if 0 <= j < len(values) and np.isclose(values[j], x):
+                return [(values[j], 1.0)]
+        if i == 0 or i == len(values):
+            raise ValueError(f"{name}={x} 超出网格范围 [{values[0]}, {values[-1]}]")
+        lo, hi = values[i - 1], values[i]
+        w = (x - lo) / (hi - lo)
+        return [(lo, 1.0 - w), (hi, w)]
+
+    def corners(self, teff, logg, feh, alpha=0.0):
+        """返回目标点的角点列表 [(文件路径, 权重), ...]；所需角点不在网格中时抛出 ValueError"""
+        brackets = [self._bracket(axis, x, name) for axis, x, name
+                    in zip(self.axes, (teff, logg, feh, alpha), ('Teff', 'logg', '[M/H]', 'alpha'))]
+        result = []
+        for combo in np.ndindex(*[len(b) for b in brackets]):
+            key = tuple(brackets[d][c][0] for d, c in enumerate(combo))
+            weight = np.prod([brackets[d][c][1] for d, c in enumerate(combo)])
+            if weight == 0:
+                continue
+            path = self.nodes.get(key)
+            if path is None:
+                raise ValueError(f"插值 (Teff={teff}, logg={logg}, [M/H]={feh}, alpha={alpha}) 所需的网格节点 {key} 不存在")
+            result.append((path, weight))
+        return result
+
+    def _load(self, path):
+        """从 LRU 缓存取内存映射的流量，超出大小上限时关闭最久未用的文件"""
+        entry = self._cache.get(path)
+        if entry is not None:
+            self._cache.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        hdul = fits.open(path, memmap=True)
+        data = spectrum_hdu(hdul).data
+        if self.window is not None:
+            data = data[self.window[0]:self.window[1]]
+        self._cache[path] = (hdul, data)
+        self._cached_bytes += data.nbytes
+        while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+            _, (old_hdul, old_data) = self._cache.popitem(last=False)
+            self._cached_bytes -= old_data.nbytes
+            del old_data
+            old_hdul.close()
+        return data
+
+    def close(self):
+        for hdul, _ in self._cache.values():
+            hdul.close()
+        self._cache.clear()
+        self._cached_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def interpolate(self, teff, logg, feh, alpha=0.0, dtype=np.float64):
+        """返回单个目标点的插值光谱"""
+        return self.interpolate_batch([(teff, logg, feh, alpha)], dtype=dtype)[0]
+
+    def interpolate_batch(self, points, dtype=np.float64):
+        """
+        points 形如 (N, 3) 或 (N, 4)，各列为 Teff, logg, [M/H], alpha（缺省 alpha = 0），返回 (N, N_pixels) 插值光谱。
+        所有目标共用的角点只读取一次。
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        if points.shape[1] == 3:
+            points = np.column_stack([points, np.zeros(len(points))])
+
+        usage = {}
+        for n, point in enumerate(points):
+            for path, weight in self.corners(*point):
+                usage.setdefault(path, []).append((n, weight))
+
+        out = None
+        for path, uses in usage.items():
+            flux = self._load(path)
+            if out is None:
+                out = np.zeros((len(points), flux.size), dtype=dtype)
+            rows = np.array([n for n, _ in uses])
+            weights = np.array([w for _, w in uses], dtype=dtype)
+            out[rows] += weights[:, None] * flux.ravel()
+        return out
+
+def interpolate_spectra(source_a_dir, source_b_dir, output_dir, index_file=INDEX_FILE,
+                        workers=WORKERS, max_in_flight_mb=MAX_IN_FLIGHT_MB, memmap_io=MEMMAP_IO,
+                        manifest_file=MANIFEST_FILE, output_manifest=OUTPUT_MANIFEST,
+                        wavelength_file=WAVELENGTH_FILE, wave_window=WAVE_WINDOW, target_r=TARGET_R,
+                        target_wave_range=TARGET_WAVE_RANGE, compression=OUTPUT_COMPRESSION):
     source_a_dir = Path(source_a_dir)
     source_b_dir = Path(source_b_dir)
     output_dir = Path(output_dir)
@@ -112,93 +708,218 @@ def interpolate_spectra(source_a_dir, source_b_dir, output_dir):
     logging.info(f"金属丰度: Z1={z1}, Z2={z2}, 插值目标 Z3={z3}")
 
     output_dir.mkdir(parents=True, exist_ok=True)
+    window, window_fraction = resolve_wavelength_window(wavelength_file, _source_window(wave_window, target_r, target_wave_range))
+    degrade = resolve_degrade(wavelength_file, window, target_r, target_wave_range)
+    compression = compression_options(compression)
 
     processed_count = 0
     error_count = 0
     matched_count = 0
+    up_to_date_count = 0
+    recipe = (f"pair z1={z1} z2={z2} z3={z3} window={window[:2] if window else None} {_degrade_recipe(degrade)} "
+              f"{_compression_recipe(compression)}")
+    run_manifest = _open_output_manifest(output_manifest, output_dir)
+    try:
+        signatures = {}
 
-    files_a = list(source_a_dir.glob("lte*.fits"))
-    total_files = len(files_a)
+        files_a, files_b = _list_source_files([source_a_dir, source_b_dir], index_file, manifest_file)
+        files_b_names = {path.name for path in files_b} if index_file or manifest_file else None
+        total_files = len(files_a)
     
-    logging.info(f"正在处理 {total_files} 个文件...")
+        logging.info(f"正在处理 {total_files} 个文件...")
     
-    for file_a_path in tqdm(files_a, desc="处理光谱文件"):
-        filename_a = file_a_path.name
-        params_a = parse_filename(filename_a)
-
-        if not params_a:
-            error_count += 1
-            continue
-
-        if not np.isclose(params_a['feh'], z1):
-            logging.warning(f"文件 {filename_a} 的金属丰度 ({params_a['feh']}) 与目录 Z1 ({z1}) 不匹配，已跳过。")
-            error_count += 1
-            continue
-
-        expected_feh_b_str = f"{z2:+.1f}"
-        alpha_b_str = ""
-        if params_a['alpha'] != 0.0:
-            alpha_b_str = f".Alpha={params_a['alpha']:+.2f}"
-
-        logg_sign = '+' if params_a['logg'] >= 0 else ''
-        logg_str = f"{logg_sign}{params_a['logg']:.2f}"
-
-        filename_b = (
-            f"lte{params_a['Teff']:05d}"
-            f"{logg_str}"
-            f"{expected_feh_b_str}"
-            f"{alpha_b_str}"
-            f".{params_a['model_suffix']}.fits"
-        )
-        file_b_path = source_b_dir / filename_b
-
-        if file_b_path.is_file():
-            matched_count += 1
-
-            try:
-                with fits.open(file_a_path) as hdul_a, fits.open(file_b_path) as hdul_b:
-                    if len(hdul_a) == 0 or len(hdul_b) == 0:
-                        logging.warning(f"文件 {filename_a} 或 {filename_b} 没有有效的 HDU，已跳过。")
-                        error_count += 1
-                        continue
-                    flux_a = hdul_a[0].data
-                    flux_b = hdul_b[0].data
-                    hdr_a = hdul_a[0].header
+        tasks = []
+        for file_a_path in files_a:
+            filename_a = file_a_path.name
+            params_a = parse_filename(filename_a)
 
-                    if flux_a.shape != flux_b.shape:
-                        logging.warning(f"文件 {filename_a} 和 {filename_b} 的数据形状不匹配，已跳过。")
-                        error_count += 1
+            if not params_a:
+                error_count += 1
+                continue
+
+            if not np.isclose(params_a['feh'], z1):
+                logging.warning(f"文件 {filename_a} 的金属丰度 ({params_a['feh']}) 与目录 Z1 ({z1}) 不匹配，已跳过。")
+                error_count += 1
+                continue
+
+            filename_b = generate_output_filename(params_a, z2, params_a['model_suffix'])
+            file_b_path = source_b_dir / filename_b
+
+            if files_b_names is not None:
+                file_b_exists = filename_b in files_b_names
+            else:
+                file_b_exists = file_b_path.is_file()
+
+            if file_b_exists:
+                matched_count += 1
+                output_path = output_dir / generate_output_filename(params_a, z3, params_a['model_suffix'])
+                if run_manifest is not None:
+                    signatures[output_path] = run_manifest.input_signature([file_a_path, file_b_path])
+                    if run_manifest.is_up_to_date(output_path, signatures[output_path], recipe):
+                        up_to_date_count += 1
                         continue
+                tasks.append((file_a_path, file_b_path, output_path, z1, z2, z3, memmap_io, window, degrade, compression))
+            else:
+                logging.debug(f"未找到文件 {filename_a} 在 {source_b_dir} 中的对应文件 {filename_b}")
+
+        if run_manifest is not None:
+            logging.info(f"{up_to_date_count} 个输出已是最新，跳过；需处理 {len(tasks)} 个文件对。")
+        if workers > 1:
+            logging.info(f"使用 {workers} 个进程并行处理 {len(tasks)} 个文件对...")
+
+        pair_mb = 3 * _source_mb(tasks[0][0], window_fraction) + _degrade_mb(degrade, 1) if tasks else 0
+        results = _run_tasks(_interpolate_pair, tasks, workers, max_in_flight_mb, pair_mb)
+        for task, failure in tqdm(results, total=len(tasks), desc="处理光谱文件"):
+            if failure is None:
+                processed_count += 1
+            else:
+                level, message = failure
+                logging.log(level, message)
+                error_count += 1
+            if run_manifest is not None:
+                run_manifest.record(task[2], signatures[task[2]], recipe, failure)
+    finally:
+        if run_manifest is not None:
+            run_manifest.close()
 
-                    flux_interp = (flux_a + flux_b) / 2.0
+    logging.info(f"插值处理完成。")
+    logging.info(f"总共扫描文件数 (源 A): {total_files}")
+    logging.info(f"找到的匹配文件对数: {matched_count}")
+    logging.info(f"已是最新而跳过的输出数: {up_to_date_count}")
+    logging.info(f"成功生成的插值光谱数: {processed_count}")
+    logging.info(f"处理过程中跳过/错误的文件数: {error_count}")
 
-                    output_filename = generate_output_filename(params_a, z3, params_a['model_suffix'])
-                    output_path = output_dir / output_filename
+def interpolate_metallicity_grid(source_dirs, target_fehs, output_root, index_file=INDEX_FILE,
+                                 workers=WORKERS, max_in_flight_mb=MAX_IN_FLIGHT_MB, manifest_file=MANIFEST_FILE,
+                                 output_manifest=OUTPUT_MANIFEST, wavelength_file=WAVELENGTH_FILE,
+                                 wave_window=WAVE_WINDOW, target_r=TARGET_R, target_wave_range=TARGET_WAVE_RANGE,
+                                 compression=OUTPUT_COMPRESSION):
+    source_dirs = [Path(d) for d in source_dirs]
+    output_root = Path(output_root)
+    logging.info(f"开始多目录金属丰度插值...")
+    logging.info(f"源目录: {', '.join(str(d) for d in source_dirs)}")
+    logging.info(f"输出根目录: {output_root}")
 
-                    hdr_new = hdr_a.copy()
-                    hdr_new['SRCMET_1'] = (z1, 'Metallicity of source spectrum 1')
-                    hdr_new['SRCMET_2'] = (z2, 'Metallicity of source spectrum 2')
-                    hdr_new['FEH_INT'] = (z3, 'Interpolated [Fe/H]')
-                    hdr_new['HISTORY'] = f"Interpolated from {filename_a} (Z={z1}) and {filename_b} (Z={z2})"
-                    hdr_new.add_history(f"Interpolation script: {os.path.basename(__file__)}")
+    try:
+        dir_fehs = [extract_metallicity_from_path(d) for d in source_dirs]
+    except ValueError as e:
+        logging.error(f"初始化失败: {e}")
+        return
 
-                    primary_hdu = fits.PrimaryHDU(data=flux_interp, header=hdr_new)
-                    hdul_out = fits.HDUList([primary_hdu])
+    if len(set(dir_fehs)) != len(dir_fehs):
+        logging.error("源目录中存在相同的金属丰度，无法进行插值。")
+        return
 
-                    hdul_out.writeto(output_path, overwrite=True)
-                    processed_count += 1
+    target_fehs = np.array(sorted(set(float(t) for t in target_fehs)))
+    logging.info(f"源金属丰度: {sorted(dir_fehs)}")
+    logging.info(f"目标金属丰度: {target_fehs.tolist()}")
 
-            except Exception as e:
-                logging.error(f"处理文件对 {filename_a} 和 {filename_b} 时出错: {e}")
+    processed_count = 0
+    error_count = 0
+    unbracketed_count = 0
+    up_to_date_count = 0
+
+    nodes = {}
+    for feh, files in zip(dir_fehs, _list_source_files(source_dirs, index_file, manifest_file)):
+        for path in files:
+            params = parse_filename(path.name)
+            if not params:
                 error_count += 1
-        else:
-            logging.debug(f"未找到文件 {filename_a} 在 {source_b_dir} 中的对应文件 {filename_b}")
+                continue
+            if not np.isclose(params['feh'], feh):
+                logging.warning(f"文件 {path.name} 的金属丰度 ({params['feh']}) 与目录 Z={feh} 不匹配，已跳过。")
+                error_count += 1
+                continue
+            key = (params['Teff'], params['logg'], params['alpha'], params['model_suffix'])
+            nodes.setdefault(key, {})[feh] = (path, params)
 
-    logging.info(f"插值处理完成。")
-    logging.info(f"总共扫描文件数 (源 A): {total_files}")
-    logging.info(f"找到的匹配文件对数: {matched_count}")
+    logging.info(f"共找到 {len(nodes)} 个 (Teff, logg, alpha) 节点。")
+
+    output_root.mkdir(parents=True, exist_ok=True)
+    window, window_fraction = resolve_wavelength_window(wavelength_file, _source_window(wave_window, target_r, target_wave_range))
+    degrade = resolve_degrade(wavelength_file, window, target_r, target_wave_range)
+    compression = compression_options(compression)
+    run_manifest = _open_output_manifest(output_manifest, output_root)
+    try:
+        signatures = {}
+        recipes = {}
+
+        tasks = []
+        for node in nodes.values():
+            fehs = sorted(node)
+            target_idx, weights = bracket_weights(fehs, target_fehs)
+            unbracketed_count += len(target_fehs) - len(target_idx)
+
+            params = next(iter(node.values()))[1]
+            stale = []
+            for row, t in enumerate(target_idx):
+                output_path = (output_root / format_metallicity_dir(target_fehs[t])
+                               / generate_output_filename(params, target_fehs[t], params['model_suffix']))
+                if run_manifest is not None:
+                    pair = np.flatnonzero(weights[row])
+                    signatures[output_path] = run_manifest.input_signature([node[fehs[i]][0] for i in pair])
+                    recipes[output_path] = (f"grid feh={target_fehs[t]} sources={[fehs[i] for i in pair]} "
+                                            f"window={window[:2] if window else None} {_degrade_recipe(degrade)} "
+                                            f"{_compression_recipe(compression)}")
+                    if run_manifest.is_up_to_date(output_path, signatures[output_path], recipes[output_path]):
+                        up_to_date_count += 1
+                        continue
+                stale.append((row, output_path))
+            if not stale:
+                continue
+
+            # 只读取至少参与一个待处理目标插值的源光谱
+            rows = [row for row, _ in stale]
+            weights = weights[rows]
+            used = np.flatnonzero(weights.any(axis=0))
+            weights = weights[:, used]
+            source_fehs = [fehs[i] for i in used]
+            source_paths = [node[f][0] for f in source_fehs]
+
+            node_targets = target_fehs[target_idx[rows]].tolist()
+            output_paths = [output_path for _, output_path in stale]
+            tasks.append((source_paths, source_fehs, node_targets, weights, output_paths, window, degrade, compression))
+
+        for output_subdir in {path.parent for task in tasks for path in task[4]}:
+            output_subdir.mkdir(parents=True, exist_ok=True)
+
+        total_outputs = sum(len(task[4]) for task in tasks)
+        if run_manifest is not None:
+            logging.info(f"{up_to_date_count} 个输出已是最新，跳过。")
+        logging.info(f"将生成 {total_outputs} 条插值光谱（{len(tasks)} 个节点）...")
+        if workers > 1:
+            logging.info(f"使用 {workers} 个进程并行处理...")
+
+        if tasks:
+            first_source_mb = _source_mb(tasks[0][0][0], window_fraction)
+            node_mb = (first_source_mb * max(len(task[0]) + len(task[4]) for task in tasks)
+                       + _degrade_mb(degrade, max(len(task[4]) for task in tasks)))
+        else:
+            node_mb = 0
+        results = _run_tasks(_interpolate_node, tasks, workers, max_in_flight_mb, node_mb)
+        for task, node_results in tqdm(results, total=len(tasks), desc="处理网格节点"):
+            for output_path, failure in zip(task[4], node_results):
+                if failure is None:
+                    processed_count += 1
+                else:
+                    level, message = failure
+                    logging.log(level, message)
+                    error_count += 1
+                if run_manifest is not None:
+                    run_manifest.record(output_path, signatures[output_path], recipes[output_path], failure)
+    finally:
+        if run_manifest is not None:
+            run_manifest.close()
+
+    logging.info(f"多目录插值处理完成。")
+    logging.info(f"处理的网格节点数: {len(tasks)}")
+    logging.info(f"已是最新而跳过的输出数: {up_to_date_count}")
     logging.info(f"成功生成的插值光谱数: {processed_count}")
+    logging.info(f"未被源金属丰度包围（或与源相同）而跳过的目标数: {unbracketed_count}")
     logging.info(f"处理过程中跳过/错误的文件数: {error_count}")
 
 if __name__ == "__main__":
-    interpolate_spectra(SOURCE_A_DIR, SOURCE_B_DIR, OUTPUT_DIR) 
\ No newline at end of file
+    if SOURCE_DIRS:
+        interpolate_metallicity_grid(SOURCE_DIRS, TARGET_FEHS, GRID_OUTPUT_ROOT)
+    else:
+        interpolate_spectra(SOURCE_A_DIR, SOURCE_B_DIR, OUTPUT_DIR) 
\ No newline at end of file
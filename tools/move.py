@@ -1,6 +1,13 @@
 import os
 import shutil
 import re
+import bisect
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from grid_index import GridIndex, print_changes, write_manifest
 
 FITS_DIR = "path/to/fits/dir"  # FITS文件所在目录
 # 筛选条件范围（左右闭区间）
@@ -8,6 +15,35 @@ TEMP_RANGE = (5500, 6500)  # 温度范围，单位K
 LOGG_RANGE = (1.0, 6.0)    # 重力范围，log(g)
 METAL_RANGE = (-1.0, 0.5)  # 金属丰度范围，[M/H]
 ALPHA_RANGE = (-0.5, 1.0)  # Alpha元素增强范围
+# 可选：参数索引文件（见 grid_index.py），设置后按索引查询而不再逐个解析目录中的文件名
+INDEX_FILE = None
+# 筛选结果的生成方式：
+#   'move'     - 移动文件（原网格目录结构会被改变）
+#   'hardlink' - 在目标目录创建硬链接（需与源文件位于同一设备），不复制数据，源目录保持不变
+#   'symlink'  - 在目标目录创建符号链接
+#   'manifest' - 不创建目录，只把选中文件的路径写入 <目标目录名>.txt 清单，
+#                可供 interpolate_spectra.py 和 Information_reading.py 的 MANIFEST_FILE 使用
+#   'transfer' - 跨设备迁移：多线程复制到 TRANSFER_DIR 下，校验通过后删除源文件，
+#                进度记录在日志文件中，中断后重新运行即可从断点继续
+MATERIALIZE = 'move'
+TRANSFER_DIR = None        # 'transfer' 方式的目标根目录（可位于其他存储卷），为 None 时使用 FITS_DIR
+TRANSFER_WORKERS = 8       # 'transfer' 方式的并发复制线程数
+TRANSFER_VERIFY = 'size'   # 复制后的校验方式：'size' 比较文件大小，'checksum' 比较 SHA-256
+TRANSFER_JOURNAL = ".transfer_journal.jsonl"  # 断点续传日志文件名（位于目标根目录）
+COPY_BUFFER = 8 * 1024 * 1024
+
+# 可选：分区模式。设置以下任一项后，只扫描一次 FITS_DIR，按 MATERIALIZE 方式把每个文件放入它所属的分区子目录，
+# 不再使用上面的单个筛选范围。
+# 方式一：命名的参数范围（左右闭区间，未列出的参数不限制），文件归入第一个匹配的分区
+PARTITION_BOXES = {
+    # 'cool_dwarfs': {'temp': (3000, 4500), 'logg': (4.0, 6.0)},
+    # 'solar_like': {'temp': (5500, 6000), 'metal': (-0.5, 0.5)},
+}
+# 方式二：按参数分箱，给出各参数的分箱边界（左闭右开，最后一箱右闭），各参数的分箱组合成分区
+PARTITION_BINS = {
+    # 'temp': [3000, 4000, 5000, 6000, 7000],
+    # 'metal': [-2.0, -1.0, 0.0, 1.0],
+}
 
 def parse_filename(filename):
     """解析FITS文件名，提取参数"""
@@ -44,20 +80,231 @@ def parse_filename(filename):
         print(f"解析文件名出错 {filename}: {str(e)}")
         return None
 
+MATERIALIZE_LABELS = {'move': '移动', 'hardlink': '硬链接', 'symlink': '符号链接'}
+
+def materialize_file(source_path, target_dir_path, filename, mode):
+    """按 mode 把文件放入目标目录（'move' / 'hardlink' / 'symlink'）"""
+    target_file_path = os.path.join(target_dir_path, filename)
+    if mode == 'move':
+        shutil.move(source_path, target_file_path)
+        return
+    if os.path.lexists(target_file_path):
+        os.remove(target_file_path)
+    if mode == 'hardlink':
+        os.link(source_path, target_file_path)
+    elif mode == 'symlink':
+        os.symlink(os.path.abspath(source_path), target_file_path)
+    else:
+        raise ValueError(f"未知的生成方式: {mode}")
+
+class TransferJournal:
+    """记录每个文件的传输进度（copied: 已复制并校验，done: 已删除源文件），每条记录追加一行 JSON"""
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.status = {}
+        complete_last_line = True
+        if os.path.exists(journal_path):
+            with open(journal_path, encoding='utf-8') as f:
+                for line in f:
+                    complete_last_line = line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 中断时可能留下不完整的最后一行
+                    self.status[entry['target']] = entry['status']
+        self._lock = threading.Lock()
+        self._file = open(journal_path, 'a', encoding='utf-8')
+        if not complete_last_line:
+            self._file.write("\n")
+
+    def record(self, source, target, status):
+        with self._lock:
+            self._file.write(json.dumps({'source': source, 'target': target, 'status': status}) + "\n")
+            self._file.flush()
+            self.status[target] = status
+
+    def close(self):
+        self._file.close()
+
+def file_digest(path):
+    """计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def copy_with_digest(source_path, target_path):
+    """复制文件并在读取源文件的同时计算其 SHA-256，避免为校验再读一遍源文件"""
+    digest = hashlib.sha256()
+    with open(source_path, 'rb') as fsrc, open(target_path, 'wb') as fdst:
+        for block in iter(lambda: fsrc.read(COPY_BUFFER), b''):
+            digest.update(block)
+            fdst.write(block)
+    shutil.copystat(source_path, target_path)
+    return digest.hexdigest()
+
+def transfer_file(source_path, target_path, journal, verify=TRANSFER_VERIFY):
+    """
+    复制单个文件并校验，然后删除源文件，返回本次实际复制的字节数（按日志恢复、无需复制时为 0）。
+    先写入 .part 临时文件再重命名，目标路径上不会出现不完整的文件。
+    """
+    size = os.path.getsize(source_path)
+    copied_bytes = 0
+    already_copied = (journal.status.get(target_path) == 'copied' and os.path.exists(target_path)
+                      and os.path.getsize(target_path) == size)
+    if not already_copied:
+        part_path = target_path + ".part"
+        try:
+            if verify == 'checksum':
+                source_digest = copy_with_digest(source_path, part_path)
+            else:
+                shutil.copyfile(source_path, part_path)
+                shutil.copystat(source_path, part_path)
+            # 先校验 .part 文件，通过后才重命名为目标文件
+            if os.path.getsize(part_path) != size or (verify == 'checksum' and file_digest(part_path) != source_digest):
+                raise IOError(f"校验失败: {target_path}")
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        os.replace(part_path, target_path)
+        journal.record(source_path, target_path, 'copied')
+        copied_bytes = size
+
+    os.remove(source_path)
+    journal.record(source_path, target_path, 'done')
+    return copied_bytes
+
+def transfer_files(pairs, journal_path, workers=TRANSFER_WORKERS):
+    """用有界线程池并发传输 (源路径, 目标路径) 列表，并输出吞吐量 (文件/s, MB/s)"""
+    journal = TransferJournal(journal_path)
+    resumed = sum(1 for _, target in pairs if journal.status.get(target) == 'copied')
+    if resumed:
+        print(f"从日志 {journal_path} 恢复: {resumed} 个文件已复制，只需校验并删除源文件")
+
+    done_count = 0
+    failed_count = 0
+    total_bytes = 0
+    start_time = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(transfer_file, source, target, journal): (source, target)
+                       for source, target in pairs}
+            for future in as_completed(futures):
+                source, target = futures[future]
+                try:
+                    total_bytes += future.result()
+                    done_count += 1
+                    print(f"传输文件: {source} -> {target}")
+                except Exception as e:
+                    failed_count += 1
+                    print(f"传输文件出错 {source}: {e}")
+    finally:
+        journal.close()
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    total_mb = total_bytes / 2**20
+    print(f"传输完成: {done_count} 个文件, 本次复制 {total_mb:.1f} MB, 用时 {elapsed:.1f} 秒, "
+          f"{done_count / elapsed:.1f} 文件/s, {total_mb / elapsed:.1f} MB/s，失败 {failed_count} 个")
+    return done_count
+
+def assign_partition(file_info):
+    """返回文件所属的分区目录名，不属于任何分区时返回 None"""
+    if PARTITION_BOXES:
+        for name, box in PARTITION_BOXES.items():
+            if all(low <= file_info[key] <= high for key, (low, high) in box.items()):
+                return name
+        return None
+
+    parts = []
+    for key, edges in PARTITION_BINS.items():
+        value = file_info[key]
+        if not edges[0] <= value <= edges[-1]:
+            return None
+        i = min(bisect.bisect_right(edges, value), len(edges) - 1)
+        parts.append(f"{key}{edges[i - 1]:g}to{edges[i]:g}")
+    return "_".join(parts)
+
+def partition():
+    """一次扫描 FITS_DIR，按 MATERIALIZE 方式把每个文件放入所属分区，并输出各分区的文件数"""
+    if INDEX_FILE:
+        with GridIndex(INDEX_FILE) as index:
+            print_changes(index.refresh([FITS_DIR]))
+            files = [row['filename'] for row in index.query(directory=FITS_DIR)]
+    else:
+        # 先完整读取目录项再移动，避免边遍历边修改目录
+        with os.scandir(FITS_DIR) as entries:
+            files = [entry.name for entry in entries if entry.is_file()]
+
+    target_root = TRANSFER_DIR if MATERIALIZE == 'transfer' and TRANSFER_DIR else FITS_DIR
+    counts = {}
+    selected = {}
+    skipped_count = 0
+    for filename in files:
+        file_info = parse_filename(filename)
+        if not file_info:
+            continue
+
+        bucket = assign_partition(file_info)
+        if bucket is None:
+            skipped_count += 1
+            continue
+
+        bucket_dir = os.path.join(target_root, bucket)
+        if bucket not in counts:
+            if MATERIALIZE != 'manifest':
+                os.makedirs(bucket_dir, exist_ok=True)
+            counts[bucket] = 0
+            selected[bucket] = []
+        file_path = os.path.join(FITS_DIR, filename)
+        if MATERIALIZE == 'manifest':
+            selected[bucket].append(file_path)
+        elif MATERIALIZE == 'transfer':
+            selected[bucket].append((file_path, os.path.join(bucket_dir, filename)))
+        else:
+            materialize_file(file_path, bucket_dir, filename, MATERIALIZE)
+        counts[bucket] += 1
+
+    if MATERIALIZE == 'manifest':
+        for bucket, paths in selected.items():
+            write_manifest(os.path.join(FITS_DIR, bucket + ".txt"), paths, f"move.py 分区清单: {bucket}")
+    elif MATERIALIZE == 'transfer':
+        transfer_files([pair for pairs in selected.values() for pair in pairs],
+                       os.path.join(target_root, TRANSFER_JOURNAL))
+
+    print("\n分区完成! 各分区文件数:")
+    for bucket in sorted(counts):
+        print(f"  {bucket}: {counts[bucket]}")
+    print(f"共处理 {sum(counts.values())} 个文件（方式: {MATERIALIZE}），分为 {len(counts)} 个分区，{skipped_count} 个文件不属于任何分区")
+
 def main():
+    if PARTITION_BOXES or PARTITION_BINS:
+        partition()
+        return
+
     target_dir_name = f"{str(TEMP_RANGE[0]).zfill(5)}-{str(TEMP_RANGE[1]).zfill(5)}-" \
                       f"{LOGG_RANGE[0]:.2f}-{LOGG_RANGE[1]:.2f}-" \
                       f"{METAL_RANGE[0]:.1f}-{METAL_RANGE[1]:.1f}-" \
                       f"{ALPHA_RANGE[0]:.2f}-{ALPHA_RANGE[1]:.2f}"
     
-    target_dir_path = os.path.join(FITS_DIR, target_dir_name)
+    target_root = TRANSFER_DIR if MATERIALIZE == 'transfer' and TRANSFER_DIR else FITS_DIR
+    target_dir_path = os.path.join(target_root, target_dir_name)
     
-    if not os.path.exists(target_dir_path):
+    if MATERIALIZE != 'manifest' and not os.path.exists(target_dir_path):
         os.makedirs(target_dir_path)
         print(f"创建目标文件夹: {target_dir_path}")
     
     moved_count = 0
-    files = os.listdir(FITS_DIR)
+    selected = []
+    if INDEX_FILE:
+        with GridIndex(INDEX_FILE) as index:
+            print_changes(index.refresh([FITS_DIR]))
+            files = [row['filename'] for row in index.query(TEMP_RANGE, LOGG_RANGE, METAL_RANGE,
+                                                            ALPHA_RANGE, directory=FITS_DIR)]
+    else:
+        files = os.listdir(FITS_DIR)
     
     for filename in files:
         file_path = os.path.join(FITS_DIR, filename)
@@ -74,12 +321,24 @@ def main():
             METAL_RANGE[0] <= file_info['metal'] <= METAL_RANGE[1] and
             ALPHA_RANGE[0] <= file_info['alpha'] <= ALPHA_RANGE[1]):
             
-            target_file_path = os.path.join(target_dir_path, filename)
-            shutil.move(file_path, target_file_path)
+            if MATERIALIZE in ('manifest', 'transfer'):
+                selected.append(file_path)
+                continue
+
+            materialize_file(file_path, target_dir_path, filename, MATERIALIZE)
             moved_count += 1
-            print(f"移动文件: {filename} -> {target_dir_name}/{filename}")
+            print(f"{MATERIALIZE_LABELS[MATERIALIZE]}文件: {filename} -> {target_dir_name}/{filename}")
     
-    print(f"\n操作完成! 共移动了 {moved_count} 个文件到 {target_dir_name} 文件夹")
+    if MATERIALIZE == 'manifest':
+        manifest_path = target_dir_path + ".txt"
+        write_manifest(manifest_path, selected, f"move.py 筛选清单: {target_dir_name}")
+        print(f"\n操作完成! 共选中 {len(selected)} 个文件，清单已写入 {manifest_path}")
+    elif MATERIALIZE == 'transfer':
+        pairs = [(path, os.path.join(target_dir_path, os.path.basename(path))) for path in selected]
+        moved_count = transfer_files(pairs, os.path.join(target_root, TRANSFER_JOURNAL))
+        print(f"\n操作完成! 共传输了 {moved_count} 个文件到 {target_dir_path} 文件夹")
+    else:
+        print(f"\n操作完成! 共{MATERIALIZE_LABELS[MATERIALIZE]}了 {moved_count} 个文件到 {target_dir_name} 文件夹")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,125 @@
+"""
+代码功能：合成光谱的内容寻址磁盘缓存。以输入参数（恒星参数、波长网格、合成方法等）的哈希为键，
+把流量保存为 float32 的 .npy 文件，读取时以内存映射方式打开。
+
+缓存总大小超过上限时按最近使用时间（LRU，读取时刷新文件修改时间）淘汰旧条目。
+每个进程每写入 REFRESH_PUTS 次重新从磁盘统计一次总大小，因此其他进程写入的条目也会计入上限。
+写入先写临时文件再原子重命名，同一台机器上的多个进程可以安全地共享同一个缓存目录。
+"""
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+CACHE_DIR = "spectrum_cache"   # 默认缓存目录
+CACHE_MAX_MB = 10240           # 默认缓存大小上限 (MB)
+REFRESH_PUTS = 64              # 每写入多少次从磁盘重新统计缓存总大小
+
+
+class SpectrumCache:
+    """合成光谱的磁盘缓存，hits/misses 记录本进程的命中与未命中次数"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_mb=CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 2**20)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._refresh_size()
+
+    def _refresh_size(self):
+        """从磁盘重新统计缓存总大小（包括其他进程写入的条目）"""
+        self._approx_bytes = sum(size for _, _, size in self._entries())
+        self._puts_since_refresh = 0
+
+    @staticmethod
+    def make_key(*parts):
+        """由任意参数（数值、字符串、numpy 数组）计算缓存键"""
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                digest.update(f"{part.dtype.str}{part.shape}".encode())
+                digest.update(np.ascontiguousarray(part).tobytes())
+            else:
+                digest.update(repr(part).encode())
+            digest.update(b"|")
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npy")
+
+    def get(self, key):
+        """返回缓存的流量（只读内存映射数组），未命中时返回 None"""
+        path = self._path(key)
+        try:
+            flux = np.load(path, mmap_mode='r')
+            os.utime(path)  # 刷新最近使用时间
+        except (FileNotFoundError, ValueError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return flux
+
+    def put(self, key, flux):
+        """以 float32 写入缓存，返回写入的 float32 数组"""
+        flux = np.asarray(flux, dtype=np.float32)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            old_size = os.path.getsize(path)  # 覆盖已有条目时不重复计入大小
+        except OSError:
+            old_size = 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, flux)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._approx_bytes += os.path.getsize(path) - old_size
+        self._puts_since_refresh += 1
+        if self._puts_since_refresh >= REFRESH_PUTS:
+            self._refresh_size()
+        if self._approx_bytes > self.max_bytes:
+            self.evict()
+        return flux
+
+    def _entries(self):
+        """遍历缓存条目，产出 (路径, 修改时间, 大小)"""
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue  # 已被其他进程淘汰
+                yield entry.path, st.st_mtime_ns, st.st_size
+
+    def evict(self, target_fraction=0.9):
+        """按最近使用时间淘汰旧条目，直到总大小降到上限的 target_fraction 以下"""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes * target_fraction:
+                break
+            try:
+                os.remove(path)
+            except (FileNotFoundError, PermissionError):
+                continue  # 已被其他进程删除，或仍被映射（Windows）
+            total -= size
+        self._approx_bytes = total
+        self._puts_since_refresh = 0
+
+    def stats(self):
+        """返回本进程的缓存统计"""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'approx_mb': self._approx_bytes / 2**20}
@@ -14,18 +14,191 @@ import sys
 import time
 from PyAstronomy import pyasl
 import synth
+from spectrum_cache import SpectrumCache
+from broadening import broaden, log_wavelength_grid, LIMB_DARKENING
 
 
 MODELS_DIR = "path/to/model/grids"  # 模型网格目录
 OUTPUT_DIR = "path/to/output/dir"   # 输出目录
 WAVE_RANGE = (3000, 10000)          # 波长范围
 RESOLUTION = 5000                   # 光谱分辨率
+WAVE_GRID = "linear"                # 波长网格："linear" 为等间隔网格，"log" 为等分辨率 (log-lambda) 网格
+SAMPLES_PER_RESEL = 1.0             # log 网格每个分辨元 (λ/R) 的采样点数；1.0 与线性网格蓝端采样相同，按奈奎斯特采样取 2.0
+LINE_WINDOW = 6.0                   # 谱线轮廓截断窗口半宽（以高斯宽度 σ 为单位）
+BATCH_CHUNK_SIZE = 256              # 批量合成时每块的恒星数
+N_DEPTH = 100                       # 大气模型的光深分层数
+INSTRUMENT_R = None                 # 可选：仪器展宽分辨率 R，None 表示不做仪器展宽（见 broadening.py）
+VSINI = None                        # 可选：自转展宽 v·sin i (km/s)，None 表示不做自转展宽
+
+# 可选：合成光谱磁盘缓存目录（见 spectrum_cache.py），相同参数、波长网格与合成方法的光谱直接从缓存读取
+CACHE_DIR = None
+CACHE_MAX_MB = 10240                # 缓存大小上限 (MB)，超出后淘汰最久未使用的条目
+
+ATMOSPHERE_DTYPE = np.dtype([('tau', 'f8'), ('temp', 'f8'), ('pgas', 'f8'), ('pe', 'f8'), ('rho', 'f8')])
 
 N_POINTS = int((WAVE_RANGE[1] - WAVE_RANGE[0]) * RESOLUTION / WAVE_RANGE[0])
 
+def make_wavelength_grid(wave_range=WAVE_RANGE, resolution=RESOLUTION, grid=WAVE_GRID,
+                         samples_per_resel=SAMPLES_PER_RESEL):
+    """
+    生成合成用的波长网格。grid="linear" 时为 N_POINTS 个等间隔点（按蓝端分辨率采样，红端过采样）；
+    grid="log" 时为 Δlnλ = 1/(resolution·samples_per_resel) 的等分辨率网格，两端点与 wave_range 一致。
+    """
+    if grid == "linear":
+        return np.linspace(wave_range[0], wave_range[1], N_POINTS)
+    if grid == "log":
+        return log_wavelength_grid(wave_range[0], wave_range[1], resolution, samples_per_resel)
+    raise ValueError(f"未知的波长网格类型: {grid}")
+
+
+def wavelength_grid_header(wavelength, grid=WAVE_GRID, resolution=RESOLUTION, samples_per_resel=SAMPLES_PER_RESEL):
+    """返回描述波长网格的 FITS 头关键字"""
+    hdr = fits.Header()
+    hdr['WAVEMIN'] = (float(np.min(wavelength)), 'Minimum wavelength (Angstrom)')
+    hdr['WAVEMAX'] = (float(np.max(wavelength)), 'Maximum wavelength (Angstrom)')
+    hdr['NPOINTS'] = (len(wavelength), 'Number of wavelength points')
+    hdr['WAVEGRID'] = (grid.upper(), 'Wavelength grid: LINEAR or LOG')
+    hdr['RESOLVP'] = (resolution, 'Resolving power R = lambda/dlambda')
+    if grid == "log":
+        hdr['SAMPRES'] = (samples_per_resel, 'Samples per resolution element')
+        hdr['DLOGLAM'] = (float(np.log(wavelength[1] / wavelength[0])), 'Step in ln(lambda)')
+    else:
+        hdr['DLAMBDA'] = (float(wavelength[1] - wavelength[0]), 'Step in lambda (Angstrom)')
+    return hdr
+
+
+def compute_line_absorption(wavelength, centers, widths, depths, combine='subtract', window=LINE_WINDOW):
+    """
+    在升序波长网格上累加高斯吸收线，每条线只在中心 ± window·σ 的窗口内求值（窗口由 searchsorted 确定），
+    计算量与 谱线数 × 窗口点数 成正比，而不是 谱线数 × 网格点数。
+
+    centers/widths/depths 的最后一维为谱线，前面的维度（如恒星数）相互广播，
+    返回形状为 前导维度 + (len(wavelength),) 的数组。
+    combine='subtract' 返回 1 - Σ 轮廓，combine='multiply' 返回 Π (1 - 轮廓)。
+    截断误差每条线不超过 depth·exp(-window²/2)，window=6 时约为 1.5e-8·depth。
+    """
+    centers, widths, depths = np.broadcast_arrays(np.asarray(centers, dtype=float),
+                                                  np.asarray(widths, dtype=float),
+                                                  np.asarray(depths, dtype=float))
+    batch_shape = centers.shape[:-1]
+    n_lines = centers.shape[-1]
+    n_points = len(wavelength)
+    centers, widths, depths = centers.ravel(), widths.ravel(), depths.ravel()
+
+    lo = np.searchsorted(wavelength, centers - window * widths, side='left')
+    hi = np.searchsorted(wavelength, centers + window * widths, side='right')
+    counts = hi - lo
+
+    # 把所有窗口拼接成一个一维索引数组，一次性向量化求值
+    line_id = np.repeat(np.arange(len(centers)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    idx = lo[line_id] + offsets
+    profile = depths[line_id] * np.exp(-(wavelength[idx] - centers[line_id])**2 / (2 * widths[line_id]**2))
+    flat_idx = (line_id // n_lines) * n_points + idx if n_lines else idx
+
+    n_spectra = int(np.prod(batch_shape))
+    if combine == 'multiply':
+        absorption = np.ones(n_spectra * n_points)
+        np.multiply.at(absorption, flat_idx, 1 - profile)
+    else:
+        absorption = 1 - np.bincount(flat_idx, weights=profile, minlength=n_spectra * n_points)
+    return absorption.reshape(batch_shape + (n_points,))
+
+class PackedSpectraWriter:
+    """
+    打包格式的多光谱 FITS 写入器：主HDU为 (N_stars, N_POINTS) 的 float32 流量图像，按块顺序追加写入；
+    关闭时追加只保存一次的 WAVELENGTH 图像HDU 和每星一行的 PARAMS 参数表（TEFF, LOGG, FEH, ALPHA）。
+    恒星总数需在创建时给定；写入中断的文件不完整，需重新生成。
+    """
+
+    def __init__(self, file_path, wavelength, n_stars, header=None):
+        self.file_path = file_path
+        self.wavelength = np.asarray(wavelength, dtype=float)
+        self.n_stars = n_stars
+        self.params = np.empty((n_stars, 4))
+        self.n_written = 0
+
+        hdr = fits.Header([('SIMPLE', True), ('BITPIX', -32), ('NAXIS', 2),
+                           ('NAXIS1', len(self.wavelength)), ('NAXIS2', n_stars)])
+        if header is not None:
+            hdr.extend(header)
+        hdr['DATE'] = (time.strftime("%Y-%m-%d"), 'Creation date')
+        hdr['WAVEMIN'] = (float(np.min(self.wavelength)), 'Minimum wavelength (Angstrom)')
+        hdr['WAVEMAX'] = (float(np.max(self.wavelength)), 'Maximum wavelength (Angstrom)')
+        hdr['NPOINTS'] = (len(self.wavelength), 'Number of wavelength points')
+        hdr['NSTARS'] = (n_stars, 'Number of spectra')
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        self._stream = fits.StreamingHDU(file_path, hdr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(finalize=exc_type is None)
+
+    def append(self, params_chunk, flux_chunk):
+        """追加一块光谱，params_chunk 形如 (n, 4)，flux_chunk 形如 (n, N_POINTS)"""
+        params_chunk = np.atleast_2d(params_chunk)
+        flux_chunk = np.asarray(flux_chunk, dtype=np.float32)
+        if flux_chunk.shape != (len(params_chunk), len(self.wavelength)):
+            raise ValueError(f"流量块形状 {flux_chunk.shape} 与参数块或波长点数不符")
+        if self.n_written + len(params_chunk) > self.n_stars:
+            raise ValueError(f"写入的光谱条数超过创建时给定的 {self.n_stars}")
+        self._stream.write(np.ascontiguousarray(flux_chunk))
+        self.params[self.n_written:self.n_written + len(params_chunk)] = params_chunk
+        self.n_written += len(params_chunk)
+
+    def close(self, finalize=True):
+        """关闭流量图像并追加波长与参数表；finalize=False 时只关闭文件"""
+        self._stream.close()
+        if not finalize:
+            return
+        if self.n_written != self.n_stars:
+            raise ValueError(f"只写入了 {self.n_written}/{self.n_stars} 条光谱，文件不完整")
+
+        wave_hdu = fits.ImageHDU(self.wavelength, name='WAVELENGTH')
+        wave_hdu.header['BUNIT'] = 'Angstrom'
+        cols = [fits.Column(name=name, format='D', array=self.params[:, i])
+                for i, name in enumerate(('TEFF', 'LOGG', 'FEH', 'ALPHA'))]
+        param_hdu = fits.BinTableHDU.from_columns(cols, name='PARAMS')
+        fits.append(self.file_path, wave_hdu.data, wave_hdu.header)
+        fits.append(self.file_path, param_hdu.data, param_hdu.header)
+
+
+class PackedSpectra:
+    """
+    读取打包格式的多光谱文件。flux 为内存映射的 (N_stars, N_POINTS) 数组，按行随机访问只读取对应的行；
+    wavelength 为波长轴，params 为参数表（FITS_rec，列 TEFF, LOGG, FEH, ALPHA）。
+    """
+
+    def __init__(self, file_path):
+        self.hdul = fits.open(file_path, memmap=True)
+        self.flux = self.hdul[0].data
+        self.wavelength = self.hdul['WAVELENGTH'].data
+        self.params = self.hdul['PARAMS'].data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.hdul.close()
+
+    def __len__(self):
+        return len(self.flux)
+
+    def __getitem__(self, row):
+        """返回第 row 条（或切片/索引数组对应的）光谱流量"""
+        return self.flux[row]
+
+
 class StellarSpectraSynthesizer:
     
-    def __init__(self, models_dir=MODELS_DIR, output_dir=OUTPUT_DIR):
+    def __init__(self, models_dir=MODELS_DIR, output_dir=OUTPUT_DIR, cache_dir=CACHE_DIR, cache_max_mb=CACHE_MAX_MB,
+                 wave_grid=WAVE_GRID, samples_per_resel=SAMPLES_PER_RESEL):
         self.models_dir = models_dir
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
@@ -35,10 +208,16 @@ class StellarSpectraSynthesizer:
         self.feh = 0.0     
         self.alpha = 0.0   
 
-        self.wavelength = np.linspace(WAVE_RANGE[0], WAVE_RANGE[1], N_POINTS)
+        self.wave_grid = wave_grid
+        self.samples_per_resel = samples_per_resel
+        self.wavelength = make_wavelength_grid(WAVE_RANGE, RESOLUTION, wave_grid, samples_per_resel)
 
         self.synth_method = self._check_available_methods()
         print(f"使用光谱合成方法: {self.synth_method}")
+
+        self.cache = SpectrumCache(cache_dir, cache_max_mb) if cache_dir else None
+        self.instrument_r = INSTRUMENT_R
+        self.vsini = VSINI
     
     def _check_available_methods(self):
         """检查可用的合成方法"""
@@ -75,26 +254,39 @@ class StellarSpectraSynthesizer:
         print(f"大气层模型构建完成，耗时 {time.time() - start_time:.2f} 秒")
         return model
     
+    def _build_atmosphere_batch(self, params):
+        """
+        批量构建大气模型（步骤一）。direct 方法返回 synth 模型列表，其余方法返回
+        (N_stars, N_DEPTH) 结构化数组；批量模式下不为每颗星写 MOOG 模型文件。
+        """
+        if self.synth_method == "direct":
+            return [synth.create_atmosphere(*p) for p in params]
+        return self._interpolate_model_grid_batch(params)
+
     def _interpolate_model_grid(self):
         """从模型网格中插值获取大气模型"""
         print("正在从模型网格插值...")
-    
-        grid_model = {
-            'tau': np.logspace(-6, 2, 100),
-            'temp': np.zeros(100),        
-            'pgas': np.zeros(100),      
-            'pe': np.zeros(100),        
-            'rho': np.zeros(100)        
-        }
-        
-        logtau = np.log10(grid_model['tau'])
-        for i, lt in enumerate(logtau):
-            grid_model['temp'][i] = self.teff * (0.7 + 0.3 * (1 - np.exp(-0.3 * (lt + 6))))
-            grid_model['pgas'][i] = 10**(lt + 4.2 + 0.1 * self.logg)
-            grid_model['pe'][i] = 10**(lt + 1.0 - 0.2 * self.feh)
-            grid_model['rho'][i] = grid_model['pgas'][i] / (8.31e7 * grid_model['temp'][i])
-            
-        return grid_model
+        params = np.array([[self.teff, self.logg, self.feh, self.alpha]], dtype=float)
+        model = self._interpolate_model_grid_batch(params)[0]
+        return {name: model[name] for name in ATMOSPHERE_DTYPE.names}
+
+    def _interpolate_model_grid_batch(self, params):
+        """
+        对 params (N, 4) 中的每颗恒星构建大气模型，全部以深度方向的数组运算完成。
+        返回形状为 (N_stars, N_DEPTH) 的结构化数组，字段见 ATMOSPHERE_DTYPE，可按 model['temp'] 等方式取列。
+        """
+        teff, logg, feh = (params[:, i:i + 1] for i in range(3))
+
+        model = np.empty((len(params), N_DEPTH), dtype=ATMOSPHERE_DTYPE)
+        model['tau'] = np.logspace(-6, 2, N_DEPTH)
+        logtau = np.log10(model['tau'][0])
+
+        model['temp'] = teff * (0.7 + 0.3 * (1 - np.exp(-0.3 * (logtau + 6))))
+        model['pgas'] = 10**(logtau + 4.2 + 0.1 * logg)
+        model['pe'] = 10**(logtau + 1.0 - 0.2 * feh)
+        model['rho'] = model['pgas'] / (8.31e7 * model['temp'])
+
+        return model
     
     def _prepare_moog_model(self):
         """准备MOOG格式的模型"""
@@ -126,10 +318,14 @@ class StellarSpectraSynthesizer:
         return flux
     
     def _interpolate_spectrum(self, model):
-        
-        continuum = self._compute_continuum()
-        
-        flux = np.ones_like(self.wavelength)
+        params = np.array([[self.teff, self.logg, self.feh, self.alpha]], dtype=float)
+        return self._interpolate_spectrum_batch(params, model)[0]
+
+    def _interpolate_spectrum_batch(self, params, model=None):
+        """对 params (N, 4) 中的每颗恒星计算插值法光谱，返回 (N, N_POINTS)；model 为对应的批量大气模型"""
+        teff, logg, feh, alpha = (params[:, i:i + 1] for i in range(4))
+
+        continuum = self._compute_continuum(teff)
         
         lines = [
             {'lambda': 4340, 'strength': 0.7, 'width': 1.0}, 
@@ -137,61 +333,62 @@ class StellarSpectraSynthesizer:
             {'lambda': 6563, 'strength': 0.9, 'width': 1.0}, 
             {'lambda': 5890, 'strength': 0.6, 'width': 0.5},  
             {'lambda': 5896, 'strength': 0.6, 'width': 0.5}, 
-            {'lambda': 6707, 'strength': 0.3 * (1 - self.feh), 'width': 0.3}, 
-            {'lambda': 5270, 'strength': 0.4 * (1 + self.feh), 'width': 0.4},  
-            {'lambda': 5328, 'strength': 0.4 * (1 + self.feh), 'width': 0.4},  
-            {'lambda': 6155, 'strength': 0.3 * (1 + self.alpha), 'width': 0.4}, 
-            {'lambda': 6162, 'strength': 0.3 * (1 + self.alpha), 'width': 0.4}, 
+            {'lambda': 6707, 'strength': 0.3 * (1 - feh), 'width': 0.3}, 
+            {'lambda': 5270, 'strength': 0.4 * (1 + feh), 'width': 0.4},  
+            {'lambda': 5328, 'strength': 0.4 * (1 + feh), 'width': 0.4},  
+            {'lambda': 6155, 'strength': 0.3 * (1 + alpha), 'width': 0.4}, 
+            {'lambda': 6162, 'strength': 0.3 * (1 + alpha), 'width': 0.4}, 
         ]
         
-        for line in lines:
-            if line['lambda'] > WAVE_RANGE[0] and line['lambda'] < WAVE_RANGE[1]:
-                line_profile = self._compute_line_profile(line)
-                flux *= (1 - line_profile)
+        lines = [line for line in lines if WAVE_RANGE[0] < line['lambda'] < WAVE_RANGE[1]]
+        thermal_scale = np.sqrt(teff / 5800)
+        flux = compute_line_absorption(self.wavelength,
+                                       [line['lambda'] for line in lines],
+                                       np.array([line['width'] for line in lines]) * thermal_scale,
+                                       np.hstack([np.broadcast_to(line['strength'], teff.shape) for line in lines]),
+                                       combine='multiply')
 
         spectrum = flux * continuum
         
         return spectrum
     
-    def _compute_continuum(self):
-        """计算连续谱能量分布"""
+    def _compute_continuum(self, teff=None):
+        """计算连续谱能量分布；teff 为形如 (N, 1) 的数组时返回 (N, N_POINTS)"""
+        if teff is None:
+            teff = self.teff
         wavelength_cm = self.wavelength * 1e-8
         h = 6.6261e-27  
         c = 2.9979e10   
         k = 1.3807e-16  
 
-        exponent = h * c / (wavelength_cm * k * self.teff)
+        exponent = h * c / (wavelength_cm * k * teff)
         continuum = (wavelength_cm ** -5) / (np.exp(exponent) - 1)
 
-        continuum /= np.max(continuum)
+        continuum /= np.max(continuum, axis=-1, keepdims=True)
         
         return continuum
-    
-    def _compute_line_profile(self, line):
-
-        center = line['lambda']
-        strength = line['strength']
-        width = line['width']
 
-        thermal_width = width * np.sqrt(self.teff / 5800)
-
-        profile = strength * np.exp(-(self.wavelength - center)**2 / (2 * thermal_width**2))
-        
-        return profile
-    
     def _call_external_synthesizer(self, model):
+        params = np.array([[self.teff, self.logg, self.feh, self.alpha]], dtype=float)
+        return self._call_external_synthesizer_batch(params, model)[0]
 
-        continuum = self._compute_continuum()
-        
-        np.random.seed(int(self.teff + self.logg * 100 + self.feh * 10 + self.alpha * 5))
-        line_mask = np.ones_like(self.wavelength)
-        for i in range(1000):
-            line_center = np.random.uniform(WAVE_RANGE[0], WAVE_RANGE[1])
-            line_width = np.random.uniform(0.1, 1.0)
-            line_depth = np.random.uniform(0, 0.5) * (1 + self.feh/2)
+    def _call_external_synthesizer_batch(self, params, model=None):
+        """对 params (N, 4) 中的每颗恒星计算外部合成器（MOOG 占位）光谱，返回 (N, N_POINTS)；model 为对应的批量大气模型"""
+        continuum = self._compute_continuum(params[:, :1])
 
-            line_profile = line_depth * np.exp(-(self.wavelength - line_center)**2 / (2 * line_width**2))
-            line_mask -= line_profile
+        n_lines = 1000
+        line_center = np.empty((len(params), n_lines))
+        line_width = np.empty((len(params), n_lines))
+        line_depth = np.empty((len(params), n_lines))
+        for i, (teff, logg, feh, alpha) in enumerate(params):
+            np.random.seed(int(teff + logg * 100 + feh * 10 + alpha * 5))
+            # 与逐条调用 np.random.uniform 的抽样顺序一致：每条线依次为 中心、宽度、深度
+            u = np.random.random_sample((n_lines, 3))
+            line_center[i] = WAVE_RANGE[0] + (WAVE_RANGE[1] - WAVE_RANGE[0]) * u[:, 0]
+            line_width[i] = 0.1 + (1.0 - 0.1) * u[:, 1]
+            line_depth[i] = 0.5 * u[:, 2] * (1 + feh/2)
+
+        line_mask = compute_line_absorption(self.wavelength, line_center, line_width, line_depth)
 
         line_mask = np.clip(line_mask, 0, 1)
 
@@ -199,13 +396,104 @@ class StellarSpectraSynthesizer:
         
         return flux
     
+    def _cache_keys(self, params):
+        """每颗恒星的缓存键，由 (teff, logg, feh, alpha)、波长网格、合成方法与谱线窗口共同决定"""
+        wave_key = SpectrumCache.make_key(self.wavelength)
+        return [SpectrumCache.make_key(self.synth_method, *(float(p) for p in row), wave_key, LINE_WINDOW)
+                for row in params]
+
     def synthesize(self):
+        if self.cache is not None:
+            key = self._cache_keys([(self.teff, self.logg, self.feh, self.alpha)])[0]
+            flux = self.cache.get(key)
+            if flux is not None:
+                return self.wavelength, self.broaden(flux)
+
         model = self._build_atmosphere_model()
         
         flux = self._synthesize_spectrum(model)
+
+        if self.cache is not None:
+            flux = self.cache.put(key, flux)
         
-        return self.wavelength, flux
+        return self.wavelength, self.broaden(flux)
+
+    def broaden(self, flux, resolution=None, vsini=None):
+        """
+        对单条或 (N, N_POINTS) 批量光谱做仪器与自转展宽（FFT 卷积，卷积核按参数缓存）。
+        resolution/vsini 缺省时使用实例上的 instrument_r/vsini，二者均未设置时原样返回。
+        """
+        resolution = self.instrument_r if resolution is None else resolution
+        vsini = self.vsini if vsini is None else vsini
+        if not resolution and not vsini:
+            return flux
+        return broaden(self.wavelength, flux, resolution, vsini)
     
+    def iter_synthesize_batch(self, params_array, chunk_size=BATCH_CHUNK_SIZE):
+        """
+        按块批量合成光谱，逐块产出 (起始行号, 流量数组 (n_chunk, N_POINTS))。
+        params_array 形如 (N_stars, 4)，各列依次为 teff, logg, feh, alpha；不修改实例上的恒星参数，也不逐星打印。
+        """
+        params = np.atleast_2d(np.asarray(params_array, dtype=float))
+        if params.ndim != 2 or params.shape[1] != 4:
+            raise ValueError(f"params_array 的形状应为 (N_stars, 4)，实际为 {params.shape}")
+
+        for start in range(0, len(params), chunk_size):
+            chunk = params[start:start + chunk_size]
+            if self.cache is None:
+                yield start, self.broaden(self._synthesize_chunk(chunk))
+                continue
+
+            # 有缓存时只合成未命中的恒星，结果以 float32 写回缓存
+            keys = self._cache_keys(chunk)
+            flux = np.empty((len(chunk), len(self.wavelength)), dtype=np.float32)
+            missing = []
+            for i, key in enumerate(keys):
+                cached = self.cache.get(key)
+                if cached is None:
+                    missing.append(i)
+                else:
+                    flux[i] = cached
+            if missing:
+                computed = self._synthesize_chunk(chunk[missing])
+                for i, row in zip(missing, computed):
+                    flux[i] = self.cache.put(keys[i], row)
+            yield start, self.broaden(flux)
+
+    def _synthesize_chunk(self, chunk):
+        model = self._build_atmosphere_batch(chunk)
+        if self.synth_method == "direct":
+            return np.array([synth.compute_spectrum(m, self.wavelength) for m in model])
+        if self.synth_method == "interpolation":
+            return self._interpolate_spectrum_batch(chunk, model)
+        return self._call_external_synthesizer_batch(chunk, model)
+
+    def synthesize_batch(self, params_array, chunk_size=BATCH_CHUNK_SIZE, out=None, dtype=np.float32):
+        """
+        批量合成多颗恒星的光谱，返回 (N_stars, N_POINTS) 流量数组。
+        大批量按 chunk_size 分块计算，中间数组的内存只与块大小有关；
+        out 可传入预分配数组（如 np.lib.format.open_memmap 得到的磁盘映射数组）以免结果整体驻留内存。
+        """
+        params = np.atleast_2d(np.asarray(params_array, dtype=float))
+        if out is None:
+            out = np.empty((len(params), len(self.wavelength)), dtype=dtype)
+        for start, flux in self.iter_synthesize_batch(params, chunk_size):
+            out[start:start + len(flux)] = flux
+        return out
+
+    def save_packed_spectra(self, params_array, filename="synth_packed.fits", chunk_size=BATCH_CHUNK_SIZE):
+        """批量合成并按块写入打包格式的多光谱文件（见 PackedSpectraWriter），返回文件路径"""
+        params = np.atleast_2d(np.asarray(params_array, dtype=float))
+        file_path = os.path.join(self.output_dir, filename)
+        header = self._wavelength_header()
+        header['METHOD'] = (self.synth_method, 'Synthesis method')
+
+        with PackedSpectraWriter(file_path, self.wavelength, len(params), header) as writer:
+            for start, flux in self.iter_synthesize_batch(params, chunk_size):
+                writer.append(params[start:start + len(flux)], flux)
+        print(f"已保存 {len(params)} 条光谱至: {file_path}")
+        return file_path
+
     def plot_spectrum(self, wavelength=None, flux=None, save_path=None):
         """绘制光谱"""
         if wavelength is None or flux is None:
@@ -224,19 +512,27 @@ class StellarSpectraSynthesizer:
         else:
             plt.show()
     
+    def _wavelength_header(self, wavelength=None):
+        if wavelength is None:
+            wavelength = self.wavelength
+        hdr = wavelength_grid_header(wavelength, self.wave_grid, RESOLUTION, self.samples_per_resel)
+        hdr['INSTR_R'] = (self.instrument_r or 0, 'Instrumental resolving power (0 = none)')
+        hdr['VSINI'] = (self.vsini or 0, 'Rotational broadening v sin i (km/s)')
+        if self.vsini:
+            hdr['LIMBDARK'] = (LIMB_DARKENING, 'Linear limb darkening coefficient')
+        return hdr
+
     def save_spectrum(self, wavelength=None, flux=None):
         if wavelength is None or flux is None:
             wavelength, flux = self.synthesize()
 
         hdr = fits.Header()
-        hdr['TEFF'] = (self.teff, '有效温度 (K)')
-        hdr['LOGG'] = (self.logg, '表面重力 (log(g))')
-        hdr['FEH'] = (self.feh, '金属丰度 [Fe/H]')
-        hdr['ALPHA'] = (self.alpha, 'Alpha元素丰度 [α/Fe]')
-        hdr['DATE'] = (time.strftime("%Y-%m-%d"), '生成日期')
-        hdr['WAVEMIN'] = (np.min(wavelength), '最小波长 (Å)')
-        hdr['WAVEMAX'] = (np.max(wavelength), '最大波长 (Å)')
-        hdr['NPOINTS'] = (len(wavelength), '波长点数')
+        hdr['TEFF'] = (self.teff, 'Effective temperature (K)')
+        hdr['LOGG'] = (self.logg, 'Surface gravity log(g)')
+        hdr['FEH'] = (self.feh, 'Metallicity [Fe/H]')
+        hdr['ALPHA'] = (self.alpha, 'Alpha element abundance [alpha/Fe]')
+        hdr['DATE'] = (time.strftime("%Y-%m-%d"), 'Creation date')
+        hdr.extend(self._wavelength_header(wavelength))
         primary_hdu = fits.PrimaryHDU(header=hdr)
 
         col1 = fits.Column(name='wavelength', format='E', array=wavelength, unit='Angstrom')
@@ -271,6 +567,9 @@ def main():
     synthesizer.set_stellar_parameters(teff, logg, feh, alpha)
     
     wavelength, flux = synthesizer.synthesize()
+    if synthesizer.cache is not None:
+        stats = synthesizer.cache.stats()
+        print(f"光谱缓存: 命中 {stats['hits']}，未命中 {stats['misses']}")
     
     print("\n请选择操作:")
     print("1. 显示光谱")
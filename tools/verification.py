@@ -1,9 +1,13 @@
 import numpy as np
 from astropy.table import Table
 from astropy.io import fits
+from scipy.spatial import cKDTree
+import hashlib
+import json
 import logging
 import os
-from tqdm import tqdm
+import pickle
+import shutil
 
 # 要比较的参数列: ('输出列名', '参考列名', '显示名称')
 PARAMS_TO_COMPARE = [
@@ -15,24 +19,409 @@ PARAMS_TO_COMPARE = [
 OUTPUT_FITS_FILENAME = 'output.fits'
 REFERENCE_CATALOG_FILENAME = 'dr11_v1.1_LRS_stellar.fits'
 VERIFICATION_MD_FILENAME = 'verification_report_zh.md'
+COMPARISON_FITS_FILENAME = 'verification_comparison.fits'  # 完整比较表（每个匹配条目一行）
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 OUTPUT_FITS_PATH = os.path.join(SCRIPT_DIR, OUTPUT_FITS_FILENAME)
 REFERENCE_CATALOG_PATH = os.path.join(SCRIPT_DIR, REFERENCE_CATALOG_FILENAME)
 VERIFICATION_MD_PATH = os.path.join(SCRIPT_DIR, VERIFICATION_MD_FILENAME)
+COMPARISON_FITS_PATH = os.path.join(SCRIPT_DIR, COMPARISON_FITS_FILENAME)
+
+# 报告方式: 'summary' 只写汇总统计（偏差、弥散、MAD、离群比例，整体及按参考值分箱），完整比较表写入 COMPARISON_FITS_PATH；
+# 'rows' 在 Markdown 报告中逐行列出每个匹配条目（匹配数很多时报告巨大且生成缓慢）
+REPORT_MODE = 'summary'
+# |估计值 - 参考值| 超过阈值记为离群，按显示名称设置
+OUTLIER_THRESHOLDS = {'Teff': 500.0, 'logg': 0.5, '[Fe/H]': 0.3}
+# 分箱统计所用的参考值区间边界 [下限, 上限)，按显示名称设置；区间外的条目只计入整体统计
+STAT_BINS = {
+    'Teff': [3000, 4000, 5000, 6000, 7000, 8000, 10000],
+    'logg': [0, 1, 2, 3, 4, 4.5, 5, 6],
+    '[Fe/H]': [-4.0, -2.0, -1.0, -0.5, 0.0, 0.5, 1.0],
+}
+
+REF_CHUNK_ROWS = 1_000_000  # 分块读取参考星表时每块的行数，决定峰值内存
+
+# 匹配方式: 'obsid' 按 obsid 精确匹配；'position' 按 RA/Dec 位置交叉匹配（KD 树，取半径内最近的参考星）
+MATCH_MODE = 'obsid'
+OUTPUT_RA_COL, OUTPUT_DEC_COL = 'ra', 'dec'   # 输出表的赤经、赤纬列（度）
+REF_RA_COL, REF_DEC_COL = 'ra', 'dec'         # 参考星表的赤经、赤纬列（度）
+MATCH_RADIUS_ARCSEC = 1.0                     # 位置匹配半径（角秒）
+# 参考星表 KD 树的缓存文件，参考星表大小或修改时间变化时自动重建；None 表示不缓存
+KDTREE_CACHE_PATH = os.path.join(SCRIPT_DIR, os.path.splitext(REFERENCE_CATALOG_FILENAME)[0] + '.kdtree.pkl')
+# 参考星表 obsid 索引目录（排序后的 obsid 与行号，内存映射读取），参考星表大小/修改时间/校验和变化时自动重建；
+# None 表示每次流式扫描参考星表
+OBSID_INDEX_PATH = os.path.join(SCRIPT_DIR, os.path.splitext(REFERENCE_CATALOG_FILENAME)[0] + '.obsid_index')
+CHECKSUM_BYTES = 4 * 2**20  # 校验和取参考星表首尾各这么多字节，避免每次运行读取整个文件
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def calculate_percentage_difference(estimated, reference):
-    if reference is None or not np.isfinite(reference) or np.isclose(reference, 0):
-        return np.nan
-    if estimated is None or not np.isfinite(estimated):
-        return np.nan
+    """逐元素计算百分比差异，参考值非有限或接近 0、估计值非有限时为 NaN；支持标量和数组"""
+    estimated = np.asarray(estimated, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    valid = np.isfinite(reference) & ~np.isclose(reference, 0) & np.isfinite(estimated)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(valid, (estimated - reference) / reference * 100.0, np.nan)
+
+def normalize_obsids(*columns):
+    """
+    把 obsid 列转换为可排序比较的 numpy 数组：字节串解码并去除首尾空白；
+    若各列中既有字符串又有数值，则统一转为字符串。
+    """
+    arrays = []
+    for column in columns:
+        values = np.asarray(column)
+        if values.dtype.kind == 'S':
+            values = np.char.strip(np.char.decode(values, 'utf-8'))
+        arrays.append(values)
+    if len({values.dtype.kind in 'SU' for values in arrays}) > 1:
+        arrays = [values.astype(str) for values in arrays]
+    return arrays
+
+def build_obsid_lookup(ref_ids):
+    """
+    排序参考星表 obsid，返回 (唯一 obsid 升序数组, 对应的首次出现行号, 重复 obsid 数)。
+    """
+    order = np.argsort(ref_ids, kind='stable')
+    sorted_ids = ref_ids[order]
+    first = np.ones(len(sorted_ids), dtype=bool)
+    first[1:] = sorted_ids[1:] != sorted_ids[:-1]
+    return sorted_ids[first], order[first], int(len(sorted_ids) - np.count_nonzero(first))
+
+def match_obsids(unique_ids, unique_rows, ids):
+    """二分查找 ids 在参考星表中的位置，返回 (是否找到的布尔数组, 找到的条目对应的参考行号)"""
+    if len(unique_ids) == 0:
+        return np.zeros(len(ids), dtype=bool), np.array([], dtype=int)
+    pos = np.searchsorted(unique_ids, ids)
+    pos_clipped = np.minimum(pos, len(unique_ids) - 1)
+    found = unique_ids[pos_clipped] == ids
+    return found, unique_rows[pos_clipped[found]]
+
+def iter_table_chunks(hdu, columns, chunk_rows=REF_CHUNK_ROWS):
+    """
+    按固定行数逐块读取内存映射的 FITS 二进制表，只取 columns 中的列，产出 (起始行号, {列名: 数组})。
+    峰值内存只与 chunk_rows 有关，与表的总行数无关。
+    """
+    data = hdu.data
+    for start in range(0, len(data), chunk_rows):
+        chunk = data[start:start + chunk_rows]
+        yield start, {name: np.array(chunk.field(name)) for name in columns}
+
+def match_reference_chunks(hdu, out_ids, columns, chunk_rows=REF_CHUNK_ROWS):
+    """
+    流式扫描参考星表，为每个输出 obsid 找到首次出现的参考行并取出 columns 中的值。
+    out_ids 需先与参考星表的 obsid 列一起经过 normalize_obsids 处理，使两者类型一致。
+    返回 (参考行号数组（未找到为 -1）, {列名: 各输出行对应的参考值}, 重复 obsid 数)。
+    重复 obsid 只统计在输出表中出现过的 obsid（全表统计需要把所有 obsid 读入内存）。
+    """
+    if len(out_ids) == 0:
+        return np.array([], dtype=np.int64), {name: np.array([]) for name in columns}, 0
+
+    unique_out, inverse = np.unique(out_ids, return_inverse=True)
+    first_row = np.full(len(unique_out), -1, dtype=np.int64)
+    matched = {}
+    duplicate_obsids = 0
+
+    for start, chunk in iter_table_chunks(hdu, ['obsid'] + columns, chunk_rows):
+        ref_ids = normalize_obsids(chunk['obsid'], unique_out)[0]
+        pos = np.minimum(np.searchsorted(unique_out, ref_ids), len(unique_out) - 1)
+        hit_rows = np.flatnonzero(unique_out[pos] == ref_ids)
+        if len(hit_rows) == 0:
+            continue
+        hit_pos = pos[hit_rows]
+
+        new = first_row[hit_pos] == -1
+        new_pos, first_in_chunk = np.unique(hit_pos[new], return_index=True)
+        new_rows = hit_rows[new][first_in_chunk]
+        duplicate_obsids += len(hit_rows) - len(new_rows)
+        first_row[new_pos] = start + new_rows
+
+        for name in columns:
+            if name not in matched:
+                matched[name] = np.zeros(len(unique_out), dtype=chunk[name].dtype)
+            matched[name][new_pos] = chunk[name][new_rows]
+
+    ref_rows = first_row[inverse]
+    values = {name: matched[name][inverse] if name in matched else np.zeros(len(out_ids))
+              for name in columns}
+    return ref_rows, values, duplicate_obsids
+
+def catalog_signature(catalog_path, checksum_bytes=CHECKSUM_BYTES):
+    """参考星表的 (大小, 修改时间, 首尾 checksum_bytes 字节的 sha256)，用于判断索引是否过期"""
+    st = os.stat(catalog_path)
+    digest = hashlib.sha256()
+    with open(catalog_path, 'rb') as f:
+        digest.update(f.read(checksum_bytes))
+        if st.st_size > checksum_bytes:
+            f.seek(max(checksum_bytes, st.st_size - checksum_bytes))
+            digest.update(f.read())
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+def build_obsid_index(hdu, index_path, signature, chunk_rows=REF_CHUNK_ROWS):
+    """
+    分块读取参考星表 obsid 列，把排序后的唯一 obsid（ids.npy）和首次出现的行号（rows.npy）
+    写入 index_path 目录，并在 meta.json 中记录参考星表签名与全表重复 obsid 数，返回重复 obsid 数。
+    先写入临时目录再重命名，中途失败不会留下不完整的索引。
+    """
+    chunks = [normalize_obsids(chunk['obsid'])[0] for _, chunk in iter_table_chunks(hdu, ['obsid'], chunk_rows)]
+    ref_ids = np.concatenate(chunks) if chunks else np.array([], dtype=np.int64)
+    del chunks
+    unique_ids, unique_rows, duplicate_obsids = build_obsid_lookup(ref_ids)
+    del ref_ids
+
+    tmp_path = index_path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, 'ids.npy'), unique_ids)
+    np.save(os.path.join(tmp_path, 'rows.npy'), unique_rows.astype(np.int64))
+    with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'signature': signature, 'duplicate_obsids': duplicate_obsids}, f)
+    shutil.rmtree(index_path, ignore_errors=True)
+    os.replace(tmp_path, index_path)
+    return duplicate_obsids
+
+def load_or_build_obsid_index(hdu, catalog_path, index_path=OBSID_INDEX_PATH, chunk_rows=REF_CHUNK_ROWS):
+    """
+    打开参考星表的 obsid 索引；索引不存在或参考星表签名不一致时重建。
+    返回 (唯一 obsid 升序数组, 对应的参考行号, 全表重复 obsid 数)，两个数组均为只读内存映射。
+    """
+    signature = catalog_signature(catalog_path)
+    meta_path = os.path.join(index_path, 'meta.json')
+    if os.path.exists(meta_path):
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['signature'] == signature:
+                logging.info(f"从索引加载参考星表 obsid: {index_path}")
+                return (np.load(os.path.join(index_path, 'ids.npy'), mmap_mode='r'),
+                        np.load(os.path.join(index_path, 'rows.npy'), mmap_mode='r'),
+                        meta['duplicate_obsids'])
+            logging.info("参考星表已变化，重建 obsid 索引。")
+        except Exception as e:
+            logging.warning(f"读取 obsid 索引 {index_path} 失败（{e}），重建。")
+
+    logging.info("构建参考星表 obsid 索引...")
+    duplicate_obsids = build_obsid_index(hdu, index_path, signature, chunk_rows)
+    logging.info(f"obsid 索引已保存至: {index_path}")
+    return (np.load(os.path.join(index_path, 'ids.npy'), mmap_mode='r'),
+            np.load(os.path.join(index_path, 'rows.npy'), mmap_mode='r'),
+            duplicate_obsids)
+
+def lookup_obsid_index(unique_ids, unique_rows, ids):
+    """
+    在 obsid 索引中批量查找 ids（向量化二分查找），返回 (规范化后的 ids, 参考行号数组（未找到为 -1）)。
+    ids 与索引一方为字符串、另一方为数值时，索引转为字符串后重新排序（需读入整个索引）。
+    """
+    ids, sample = normalize_obsids(ids, unique_ids[:1])
+    if sample.dtype.kind != unique_ids.dtype.kind:
+        str_ids = np.asarray(unique_ids).astype(str)
+        order = np.argsort(str_ids, kind='stable')
+        unique_ids, unique_rows = str_ids[order], np.asarray(unique_rows)[order]
+    ref_rows = np.full(len(ids), -1, dtype=np.int64)
+    found, rows = match_obsids(unique_ids, unique_rows, ids)
+    ref_rows[found] = rows
+    return ids, ref_rows
+
+def radec_to_unit_vectors(ra, dec):
+    """赤经、赤纬（度）转换为单位球面上的 (N, 3) 直角坐标"""
+    ra = np.radians(np.asarray(ra, dtype=float))
+    dec = np.radians(np.asarray(dec, dtype=float))
+    cos_dec = np.cos(dec)
+    return np.column_stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)])
+
+def build_position_tree(hdu, ra_col=REF_RA_COL, dec_col=REF_DEC_COL, chunk_rows=REF_CHUNK_ROWS):
+    """
+    分块读取参考星表的赤经、赤纬，在单位向量上构建 cKDTree。
+    返回 (树, 树中各点对应的参考行号)；坐标无效的行不进入树。
+    """
+    vectors = []
+    rows = []
+    for start, chunk in iter_table_chunks(hdu, [ra_col, dec_col], chunk_rows):
+        ra = np.asarray(chunk[ra_col], dtype=float)
+        dec = np.asarray(chunk[dec_col], dtype=float)
+        valid = np.flatnonzero(np.isfinite(ra) & np.isfinite(dec))
+        vectors.append(radec_to_unit_vectors(ra[valid], dec[valid]))
+        rows.append(start + valid)
+    vectors = np.concatenate(vectors) if vectors else np.empty((0, 3))
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+    return cKDTree(vectors, balanced_tree=False, compact_nodes=False), rows
+
+def load_or_build_position_tree(hdu, catalog_path, cache_path=KDTREE_CACHE_PATH,
+                                ra_col=REF_RA_COL, dec_col=REF_DEC_COL, chunk_rows=REF_CHUNK_ROWS):
+    """
+    从缓存文件加载参考星表的 KD 树；缓存不存在、参考星表大小/修改时间或坐标列不一致时重建并保存。
+    返回 (树, 树中各点对应的参考行号)。
+    """
+    st = os.stat(catalog_path)
+    signature = (st.st_size, st.st_mtime_ns, ra_col, dec_col)
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['signature'] == signature:
+                logging.info(f"从缓存加载 KD 树: {cache_path}")
+                return cached['tree'], cached['rows']
+            logging.info("参考星表已变化，重建 KD 树。")
+        except Exception as e:
+            logging.warning(f"读取 KD 树缓存 {cache_path} 失败（{e}），重建。")
+
+    logging.info("构建参考星表位置 KD 树...")
+    tree, rows = build_position_tree(hdu, ra_col, dec_col, chunk_rows)
+    logging.info(f"KD 树构建完成，共 {len(rows)} 个有效位置。")
+    if cache_path:
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'signature': signature, 'tree': tree, 'rows': rows}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        logging.info(f"KD 树已保存至: {cache_path}")
+    return tree, rows
+
+def match_positions(tree, tree_rows, ra, dec, radius_arcsec=MATCH_RADIUS_ARCSEC):
+    """
+    为每个 (ra, dec) 查找半径内最近的参考星，返回 (参考行号数组（未找到为 -1）, 角距数组（角秒，未找到为 NaN）)。
+    """
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    ref_rows = np.full(len(ra), -1, dtype=np.int64)
+    separations = np.full(len(ra), np.nan)
+    valid = np.flatnonzero(np.isfinite(ra) & np.isfinite(dec))
+    if len(valid) == 0 or tree.n == 0:
+        return ref_rows, separations
+
+    # 角距 θ 对应的单位球弦长为 2·sin(θ/2)
+    max_chord = 2 * np.sin(np.radians(radius_arcsec / 3600.0) / 2)
+    chord, idx = tree.query(radec_to_unit_vectors(ra[valid], dec[valid]), k=1,
+                            distance_upper_bound=max_chord * (1 + 1e-12), workers=-1)
+    hit = np.isfinite(chord)
+    ref_rows[valid[hit]] = tree_rows[idx[hit]]
+    separations[valid[hit]] = np.degrees(2 * np.arcsin(np.minimum(chord[hit] / 2, 1.0))) * 3600.0
+    return ref_rows, separations
+
+def take_reference_rows(hdu, ref_rows, columns, chunk_rows=REF_CHUNK_ROWS):
+    """
+    按行号从内存映射的参考星表中取出 columns 列的值（行号为 -1 的条目取 0/空值）。
+    按块顺序读取，只读取包含所需行的块。
+    """
+    data = hdu.data
+    values = {name: np.zeros(len(ref_rows), dtype=data.columns[name].dtype) for name in columns}
+    wanted = np.flatnonzero(ref_rows >= 0)
+    order = wanted[np.argsort(ref_rows[wanted], kind='stable')]
+    sorted_rows = ref_rows[order]
+    for start in range(0, len(data), chunk_rows):
+        lo, hi = np.searchsorted(sorted_rows, [start, start + chunk_rows])
+        if lo == hi:
+            continue
+        chunk = data[start:start + chunk_rows]
+        for name in columns:
+            values[name][order[lo:hi]] = chunk.field(name)[sorted_rows[lo:hi] - start]
+    return values
+
+def to_float_column(column):
+    """把一列转换为 float 数组，返回 (数值, 是否转换成功)；掩码值记为 NaN"""
     try:
-        return ((float(estimated) - float(reference)) / float(reference)) * 100.0
-    except (TypeError, ValueError):
-        return np.nan
+        values = np.ma.filled(np.ma.asarray(column).astype(float), np.nan)
+        return np.array(values, dtype=float), np.ones(len(values), dtype=bool)
+    except (ValueError, TypeError):
+        values = np.full(len(column), np.nan)
+        ok = np.zeros(len(column), dtype=bool)
+        for i, item in enumerate(column):
+            try:
+                values[i] = float(item)
+                ok[i] = True
+            except (ValueError, TypeError):
+                pass
+        return values, ok
+
+def difference_statistics(diff, threshold):
+    """
+    差值（估计值 - 参考值）的统计，忽略 NaN：数目、偏差（均值）、弥散（标准差）、
+    MAD（相对中位数的中位绝对偏差）、离群比例（|差值| > threshold）。
+    """
+    diff = np.asarray(diff, dtype=float)
+    diff = diff[np.isfinite(diff)]
+    n = len(diff)
+    if n == 0:
+        return {'n': 0, 'bias': np.nan, 'scatter': np.nan, 'mad': np.nan, 'outlier_frac': np.nan}
+    return {'n': n,
+            'bias': float(diff.mean()),
+            'scatter': float(diff.std(ddof=1)) if n > 1 else np.nan,
+            'mad': float(np.median(np.abs(diff - np.median(diff)))),
+            'outlier_frac': np.count_nonzero(np.abs(diff) > threshold) / n}
+
+def binned_statistics(diffs, bin_values, edges, thresholds):
+    """
+    按 bin_values 落入的区间 [edges[i], edges[i+1]) 分箱，对 diffs（{名称: 差值数组}）中每一列计算
+    difference_statistics。只排序一次，各箱为排序后数组的连续切片。
+    返回 [(下限, 上限, 条目数, {名称: 统计})]。
+    """
+    edges = np.asarray(edges, dtype=float)
+    bin_idx = np.digitize(np.asarray(bin_values, dtype=float), edges) - 1  # 区间外为 -1 或 len(edges)-1
+    order = np.argsort(bin_idx, kind='stable')
+    bounds = np.searchsorted(bin_idx[order], np.arange(len(edges)))
+    sorted_diffs = {name: np.asarray(diff, dtype=float)[order] for name, diff in diffs.items()}
+
+    results = []
+    for i in range(len(edges) - 1):
+        lo, hi = bounds[i], bounds[i + 1]
+        results.append((edges[i], edges[i + 1], int(hi - lo),
+                        {name: difference_statistics(diff[lo:hi], thresholds[name])
+                         for name, diff in sorted_diffs.items()}))
+    return results
+
+def build_summary_report(comparison_data, not_found_count, params=PARAMS_TO_COMPARE,
+                         thresholds=OUTLIER_THRESHOLDS, stat_bins=STAT_BINS):
+    """由比较表生成汇总统计的 Markdown 报告（整体统计 + 按各参数参考值分箱的统计）"""
+    names = [name for _, _, name in params]
+    diffs = {name: np.asarray(comparison_data[f'{name}_est']) - np.asarray(comparison_data[f'{name}_ref'])
+             for name in names}
+    precisions = {name: 0 if name == 'Teff' else 3 for name in names}
+
+    lines = ["## 整体统计", "",
+             "差值为 估计值 - 参考值；偏差为均值，弥散为标准差，MAD 为相对中位数的中位绝对偏差。", "",
+             "| 参数 | 数目 | 偏差 | 弥散 | MAD | 离群阈值 | 离群比例 |",
+             "|:---|---:|---:|---:|---:|---:|---:|"]
+    for name in names:
+        st = difference_statistics(diffs[name], thresholds[name])
+        p = precisions[name]
+        lines.append(f"| {name} | {st['n']} | {format_value(st['bias'], p)} | {format_value(st['scatter'], p)} "
+                     f"| {format_value(st['mad'], p)} | {thresholds[name]} | {format_percentage(st['outlier_frac'] * 100)} |")
+
+    for bin_name, edges in stat_bins.items():
+        if bin_name not in names:
+            continue
+        lines.extend(["", f"## 按 {bin_name}（参考值）分箱", "",
+                      "| 区间 | 数目 | " + " | ".join(f"{name} 偏差 | {name} 弥散 | {name} MAD | {name} 离群"
+                                                  for name in names) + " |",
+                      "|:---|---:|" + "---:|" * (4 * len(names))])
+        ref_values = np.asarray(comparison_data[f'{bin_name}_ref'])
+        for lo, hi, n, stats in binned_statistics(diffs, ref_values, edges, thresholds):
+            if n == 0:
+                continue
+            cells = []
+            for name in names:
+                st, p = stats[name], precisions[name]
+                cells.extend([format_value(st['bias'], p), format_value(st['scatter'], p),
+                              format_value(st['mad'], p), format_percentage(st['outlier_frac'] * 100)])
+            lines.append(f"| [{lo:g}, {hi:g}) | {n} | " + " | ".join(cells) + " |")
+
+    lines.extend(["", f"匹配条目 {len(comparison_data)} 个，未匹配 {not_found_count} 个。"])
+    return "\n".join(lines) + "\n"
+
+def write_comparison_fits(comparison_data, path, params=PARAMS_TO_COMPARE):
+    """
+    把完整比较表写入 FITS 二进制表。列名改用参考列名（如 teff_est, teff_ref, teff_diff, teff_pctdiff），
+    避免显示名称中的 [、/、% 等字符不符合 FITS 列名习惯。
+    """
+    table = Table()
+    for column in comparison_data.colnames:
+        table[column] = comparison_data[column]
+    for _, ref_col, name in params:
+        table.rename_column(f'{name}_est', f'{ref_col}_est')
+        table.rename_column(f'{name}_ref', f'{ref_col}_ref')
+        table.rename_column(f'{name}_%diff', f'{ref_col}_pctdiff')
+        table[f'{ref_col}_diff'] = table[f'{ref_col}_est'] - table[f'{ref_col}_ref']
+    table.write(path, format='fits', overwrite=True)
 
 def format_value(value, precision=2):
     if value is None or not np.isfinite(value):
@@ -62,121 +451,121 @@ if __name__ == "__main__":
         logging.error(f"加载结果文件时出错: {e}")
         exit()
 
-    logging.info(f"加载参考星表: {REFERENCE_CATALOG_PATH}")
-    try:
-        with fits.open(REFERENCE_CATALOG_PATH) as hdul:
-            if len(hdul) < 2:
-                 logging.error(f"错误: FITS文件 {REFERENCE_CATALOG_PATH} 不含数据 HDU。")
-                 exit()
-            ref_catalog = Table(hdul[1].data)
-        logging.info(f"已加载 {len(ref_catalog)} 条参考条目。")
-    except FileNotFoundError:
-        logging.error(f"错误: 参考星表未找到: {REFERENCE_CATALOG_PATH}")
-        exit()
-    except Exception as e:
-        logging.error(f"加载参考星表时出错: {e}")
-        exit()
-
-    required_output_cols = ['obsid'] + [p[0] for p in PARAMS_TO_COMPARE]
+    position_mode = MATCH_MODE == 'position'
+    id_cols = [OUTPUT_RA_COL, OUTPUT_DEC_COL] if position_mode else ['obsid']
+    required_output_cols = id_cols + [p[0] for p in PARAMS_TO_COMPARE]
     missing_output_cols = [col for col in required_output_cols if col not in output_table.colnames]
     if missing_output_cols:
         logging.error(f"错误: 输出表缺少列: {', '.join(missing_output_cols)}")
         exit()
 
-    required_ref_cols = ['obsid'] + [p[1] for p in PARAMS_TO_COMPARE]
-    missing_ref_cols = [col for col in required_ref_cols if col not in ref_catalog.colnames]
-    if missing_ref_cols:
-        logging.error(f"错误: 参考表缺少列: {', '.join(missing_ref_cols)}")
-        exit()
-
-    logging.info("构建参考星表查找字典...")
-    ref_lookup = {}
-    duplicate_obsids = 0
+    ref_value_cols = [p[1] for p in PARAMS_TO_COMPARE]
+    use_obsid_index = not position_mode and OBSID_INDEX_PATH is not None
+    if position_mode:
+        logging.info(f"按位置交叉匹配参考星表: {REFERENCE_CATALOG_PATH}（匹配半径 {MATCH_RADIUS_ARCSEC} 角秒）")
+    elif use_obsid_index:
+        logging.info(f"按 obsid 索引匹配参考星表: {REFERENCE_CATALOG_PATH}")
+    else:
+        logging.info(f"分块读取参考星表: {REFERENCE_CATALOG_PATH}（仅读取 obsid, {', '.join(ref_value_cols)} 列，每块 {REF_CHUNK_ROWS} 行）")
     try:
-        iterator = tqdm(range(len(ref_catalog)), desc="构建查找表") if len(ref_catalog) > 10000 else range(len(ref_catalog))
-        for i in iterator:
-            try:
-                obsid = ref_catalog['obsid'][i]
-                if isinstance(obsid, bytes):
-                    obsid = obsid.decode('utf-8').strip()
-                # obsid = str(obsid) # 可选：强制转为字符串
+        with fits.open(REFERENCE_CATALOG_PATH, memmap=True) as hdul:
+            if len(hdul) < 2:
+                 logging.error(f"错误: FITS文件 {REFERENCE_CATALOG_PATH} 不含数据 HDU。")
+                 exit()
 
-            except Exception as e:
-                logging.debug(f"处理参考表第 {i} 行 'obsid' 出错: {e}，跳过。")
-                continue
+            required_ref_cols = ['obsid'] + ([REF_RA_COL, REF_DEC_COL] if position_mode else []) + ref_value_cols
+            missing_ref_cols = [col for col in required_ref_cols if col not in hdul[1].columns.names]
+            if missing_ref_cols:
+                logging.error(f"错误: 参考表缺少列: {', '.join(missing_ref_cols)}")
+                exit()
 
-            if obsid not in ref_lookup:
-                ref_lookup[obsid] = i
+            logging.info(f"参考星表共 {hdul[1].header['NAXIS2']} 条参考条目。")
+            if position_mode:
+                tree, tree_rows = load_or_build_position_tree(hdul[1], REFERENCE_CATALOG_PATH)
+                ref_rows, separations = match_positions(tree, tree_rows, output_table[OUTPUT_RA_COL],
+                                                        output_table[OUTPUT_DEC_COL])
+                ref_values = take_reference_rows(hdul[1], ref_rows, ['obsid'] + ref_value_cols)
+                out_ids = normalize_obsids(ref_values['obsid'])[0]  # 报告中显示匹配到的参考星 obsid
+                duplicate_obsids = 0
+            elif use_obsid_index:
+                unique_ids, unique_rows, duplicate_obsids = load_or_build_obsid_index(hdul[1], REFERENCE_CATALOG_PATH)
+                out_ids, ref_rows = lookup_obsid_index(unique_ids, unique_rows, output_table['obsid'])
+                ref_values = take_reference_rows(hdul[1], ref_rows, ref_value_cols)
             else:
-                duplicate_obsids += 1
-
-        if duplicate_obsids > 0:
-             logging.warning(f"参考星表中发现 {duplicate_obsids} 个重复obsid，使用首次出现的条目。")
-        logging.info(f"查找字典构建完成，含 {len(ref_lookup)} 个唯一obsid。")
-    except KeyError:
-        logging.error("错误: 参考星表中未找到 'obsid' 列。")
+                out_ids = normalize_obsids(output_table['obsid'], hdul[1].data.field('obsid')[:1])[0]
+                ref_rows, ref_values, duplicate_obsids = match_reference_chunks(hdul[1], out_ids, ref_value_cols)
+    except FileNotFoundError:
+        logging.error(f"错误: 参考星表未找到: {REFERENCE_CATALOG_PATH}")
         exit()
     except Exception as e:
-        logging.error(f"构建查找字典时出错: {e}")
+        logging.error(f"读取参考星表时出错: {e}")
         exit()
 
+    if duplicate_obsids > 0:
+         scope = "" if use_obsid_index else "（仅统计结果文件中出现的obsid）"
+         logging.warning(f"参考星表中发现 {duplicate_obsids} 个重复obsid{scope}，使用首次出现的条目。")
+
     logging.info("比较结果与参考星表...")
-    comparison_data = []
-    not_found_count = 0
+    found = ref_rows >= 0
+    not_found_count = int(np.count_nonzero(~found))
 
-    for output_row in tqdm(output_table, desc="比较条目"):
-        try:
-            obsid = output_row['obsid']
-            if isinstance(obsid, bytes):
-                obsid = obsid.decode('utf-8').strip()
-            # obsid = str(obsid) # 可选：强制转为字符串
-        except Exception as e:
-            logging.debug(f"处理输出表某行 'obsid' 出错: {e}，跳过。")
-            continue
+    comparison_data = Table()
+    comparison_data['obsid'] = out_ids[found]
+    if position_mode:
+        comparison_data['sep_arcsec'] = separations[found]
+    valid_comparison = np.ones(np.count_nonzero(found), dtype=bool)
+    for est_col, ref_col, name in PARAMS_TO_COMPARE:
+        est_val, est_ok = to_float_column(output_table[est_col][found])
+        ref_val, ref_ok = to_float_column(ref_values[ref_col][found])
+        ok = est_ok & ref_ok
+        est_val[~ok] = np.nan
+        ref_val[~ok] = np.nan
+        valid_comparison &= ok
 
-        ref_row_index = ref_lookup.get(obsid)
-
-        if ref_row_index is not None:
-            ref_row = ref_catalog[ref_row_index]
-            data_row = {'obsid': obsid}
-            valid_comparison = True
-
-            for est_col, ref_col, name in PARAMS_TO_COMPARE:
-                try:
-                    est_val = float(output_row[est_col])
-                    ref_val = float(ref_row[ref_col])
-                except (ValueError, TypeError, KeyError) as e:
-                    logging.debug(f"处理 obsid={obsid}, 参数={name} 出错: {e}")
-                    est_val, ref_val = np.nan, np.nan
-                    valid_comparison = False
-
-                perc_diff = calculate_percentage_difference(est_val, ref_val)
-                data_row[f'{name}_est'] = est_val
-                data_row[f'{name}_ref'] = ref_val
-                data_row[f'{name}_%diff'] = perc_diff
-
-            # 可选：即使部分无效也记录（移除 if valid_comparison）
-            if valid_comparison:
-                 comparison_data.append(data_row)
-            else:
-                 logging.warning(f"obsid={obsid} 数据比较不完整（存在无效值）。")
-                 # comparison_data.append(data_row) # 若要记录不完整行，取消此行注释
+        comparison_data[f'{name}_est'] = est_val
+        comparison_data[f'{name}_ref'] = ref_val
+        comparison_data[f'{name}_%diff'] = calculate_percentage_difference(est_val, ref_val)
 
-        else:
-            not_found_count += 1
-            logging.debug(f"obsid={obsid} 未在参考星表中找到。")
+    # 可选：即使部分无效也记录（去掉下面的筛选）
+    if not valid_comparison.all():
+        for obsid in comparison_data['obsid'][~valid_comparison]:
+            logging.debug(f"obsid={obsid} 数据比较不完整（存在无效值）。")
+        logging.warning(f"{np.count_nonzero(~valid_comparison)} 个 obsid 数据比较不完整（存在无效值），已从报告中排除。")
+        comparison_data = comparison_data[valid_comparison]
 
     logging.info(f"比较完成。找到 {len(comparison_data)} 个匹配条目。")
     if not_found_count > 0:
-        logging.warning(f"{not_found_count} 个 obsid 未在参考星表中找到。")
+        if position_mode:
+            logging.warning(f"{not_found_count} 条结果在 {MATCH_RADIUS_ARCSEC} 角秒内没有参考星。")
+        else:
+            logging.warning(f"{not_found_count} 个 obsid 未在参考星表中找到。")
 
-    if not comparison_data:
+    if len(comparison_data) > 0 and COMPARISON_FITS_PATH:
+        try:
+            write_comparison_fits(comparison_data, COMPARISON_FITS_PATH)
+            logging.info(f"完整比较表已写入: {COMPARISON_FITS_PATH}")
+        except Exception as e:
+            logging.error(f"写入比较表时出错: {e}")
+
+    if len(comparison_data) == 0:
         logging.warning("未找到匹配条目，无法生成报告。")
         markdown_content = "# 验证报告\n\n结果文件与参考星表无匹配项。\n"
+    elif REPORT_MODE == 'summary':
+        logging.info("生成汇总统计报告...")
+        markdown_content = "# 验证报告\n\n"
+        markdown_content += f"比较 `{os.path.basename(OUTPUT_FITS_PATH)}` 与 `{os.path.basename(REFERENCE_CATALOG_PATH)}`。\n\n"
+        if position_mode:
+            markdown_content += f"按位置交叉匹配（半径 {MATCH_RADIUS_ARCSEC} 角秒）。\n\n"
+        if COMPARISON_FITS_PATH:
+            markdown_content += f"逐条比较结果见 `{os.path.basename(COMPARISON_FITS_PATH)}`。\n\n"
+        markdown_content += build_summary_report(comparison_data, not_found_count)
     else:
         logging.info("生成Markdown报告...")
         header_parts = ["| obsid "]
         separator_parts = ["|:---|"]
+        if position_mode:
+            header_parts.append("| 角距 (\") ")
+            separator_parts.append("---:|")
         for _, _, name in PARAMS_TO_COMPARE:
             header_parts.extend([f"| {name} (估计) ", f"| {name} (参考) ", f"| {name} (%差异) "])
             separator_parts.extend(["|---:|---:|---:|"])
@@ -186,6 +575,8 @@ if __name__ == "__main__":
         data_rows = []
         for row_data in comparison_data:
             row_parts = [f"| {row_data['obsid']} "]
+            if position_mode:
+                row_parts.append(f"| {format_value(row_data['sep_arcsec'], 2)} ")
             for _, _, name in PARAMS_TO_COMPARE:
                 precision = 0 if name == 'Teff' else 2
                 p_precision = 1
@@ -198,6 +589,8 @@ if __name__ == "__main__":
 
         markdown_content = "# 验证报告\n\n"
         markdown_content += f"比较 `{os.path.basename(OUTPUT_FITS_PATH)}` 与 `{os.path.basename(REFERENCE_CATALOG_PATH)}`。\n\n" # 报告中只显示文件名
+        if position_mode:
+            markdown_content += f"按位置交叉匹配（半径 {MATCH_RADIUS_ARCSEC} 角秒），obsid 为匹配到的参考星。\n\n"
         markdown_content += header + "\n"
         markdown_content += separator + "\n"
         markdown_content += "\n".join(data_rows)